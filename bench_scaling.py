@@ -0,0 +1,113 @@
+"""Compare per-surface scaling (scale_to_fill_width_centered / scale_to_cover) with the
+batched path on the same set of decoded images. Both paths start from RGB Pillow images,
+as a cache builder has them after decoding.
+
+Uses the images under ./data when available, random images otherwise (--size forces
+random images of that size, e.g. 4000x3000 to measure camera-sized sources).
+
+    python bench_scaling.py [--count 64] [--repeat 3] [--size WxH]
+"""
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import numpy as np
+from PIL import Image
+
+from main import (
+    CANVAS_WIDTH, CANVAS_HEIGHT, TOP_BAR_H, MIDDLE_GAP, DATA_DIRNAME,
+    resource_path, index_dataset,
+    scale_to_fill_width_centered, scale_to_cover,
+    scale_batch_to_fill_width_centered, scale_batch_to_cover,
+)
+
+
+def load_images(count: int, size=None):
+    real_map, fake_map = index_dataset(resource_path(DATA_DIRNAME))
+    paths = [p for m in (real_map, fake_map) for files in m.values() for p in files]
+    if paths and size is None:
+        images = []
+        for p in paths[:count]:
+            try:
+                images.append(Image.open(p).convert("RGB"))
+            except Exception as e:
+                print(f"Skipping {p}: {e}")
+        return images
+    rng = np.random.default_rng(0)
+    if size is not None:
+        w, h = size
+        sizes = [(h, w), (w, h)]
+    else:
+        print("No dataset found, using random images.")
+        sizes = [(480, 640), (640, 480), (768, 1024), (300, 300)]
+    return [Image.fromarray(rng.integers(0, 256, size=(*sizes[i % len(sizes)], 3), dtype=np.uint8))
+            for i in range(count)]
+
+
+def to_surface(image: Image.Image) -> pygame.Surface:
+    return pygame.image.frombuffer(image.tobytes(), image.size, "RGB").convert()
+
+
+def surface_rgba(surf: pygame.Surface) -> np.ndarray:
+    rgb = pygame.surfarray.array3d(surf).transpose(1, 0, 2)
+    if surf.get_flags() & pygame.SRCALPHA:
+        alpha = pygame.surfarray.array_alpha(surf).T[..., None]
+        return np.concatenate([rgb, alpha], axis=2)
+    return rgb
+
+
+def best_of(repeat: int, fn):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def compare(name, images, single_fn, batch_fn, target_w, target_h, channels, repeat):
+    out = np.empty((len(images), target_h, target_w, channels), dtype=np.uint8)
+
+    t_single, singles = best_of(repeat, lambda: [single_fn(to_surface(im), target_w, target_h) for im in images])
+    t_batch, _ = best_of(repeat, lambda: batch_fn(images, target_w, target_h, out=out))
+
+    diffs = [np.abs(surface_rgba(s).astype(np.int16) - out[i].astype(np.int16)) for i, s in enumerate(singles)]
+    max_diff = max(int(d.max()) for d in diffs)
+    mean_diff = float(np.mean([d.mean() for d in diffs]))
+    n = len(images)
+    print(f"{name}: {n} images -> {target_w}x{target_h}")
+    print(f"  per-surface: {t_single * 1000:8.1f} ms  ({t_single * 1000 / n:.2f} ms/img)")
+    print(f"  batched:     {t_batch * 1000:8.1f} ms  ({t_batch * 1000 / n:.2f} ms/img)")
+    print(f"  max abs diff {max_diff}, mean abs diff {mean_diff:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=64, help="number of images")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path, best time is reported")
+    parser.add_argument("--size", help="use random images of this size, e.g. 4000x3000")
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    images = load_images(args.count, tuple(int(v) for v in args.size.split("x")) if args.size else None)
+    if not images:
+        print("No images to benchmark.")
+        sys.exit(1)
+
+    target_w = (CANVAS_WIDTH - MIDDLE_GAP) // 2
+    target_h = CANVAS_HEIGHT - TOP_BAR_H
+    compare("fill_width_centered", images, scale_to_fill_width_centered, scale_batch_to_fill_width_centered,
+            target_w, target_h, 4, args.repeat)
+    compare("cover", images, scale_to_cover, scale_batch_to_cover, target_w, target_h, 3, args.repeat)
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
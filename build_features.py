@@ -0,0 +1,224 @@
+"""Offline feature extraction for pair difficulty.
+
+Computes cheap per-image features for every image in ./data (frequency-domain
+statistics, noise residuals and JPEG quantization traits) across a process pool
+and writes them, together with real->fake nearest-neighbour indexes (over all fakes and
+within each category), to data/features.npz. The game uses the indexes when
+MATCH_BY_FEATURES is enabled.
+
+    python build_features.py [--data data] [--workers N] [--batch 32] [--neighbours 8]
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from main import DATA_DIRNAME, FEATURES_FILENAME, resource_path, index_dataset
+
+CROP = 256  # analysis window, taken at native resolution so noise is not resampled away
+N_BANDS = 8
+
+FEATURE_NAMES = (
+    [f"spec_band_{i}" for i in range(N_BANDS)]
+    + ["spec_slope", "spec_high_ratio"]
+    + ["res_std", "res_mean_abs", "res_kurtosis"]
+    + ["is_jpeg", "q_luma_mean", "q_luma_dc", "q_chroma_mean"]
+    + ["log_aspect"]
+)
+
+
+def _radial_bins():
+    fy = np.fft.fftfreq(CROP)[:, None]
+    fx = np.fft.rfftfreq(CROP)[None, :]
+    radius = np.sqrt(fx * fx + fy * fy) / np.sqrt(0.5)  # 0..1
+    bins = np.minimum((radius * N_BANDS).astype(np.intp), N_BANDS - 1)
+    return radius, bins
+
+
+RADIUS, BINS = _radial_bins()
+BIN_COUNTS = np.bincount(BINS.ravel(), minlength=N_BANDS)
+
+
+def center_crop_gray(img: Image.Image) -> np.ndarray:
+    gray = img.convert("L")
+    w, h = gray.size
+    short = min(w, h)
+    if short < CROP:
+        k = CROP / short
+        gray = gray.resize((max(CROP, round(w * k)), max(CROP, round(h * k))), Image.BILINEAR)
+        w, h = gray.size
+    x, y = (w - CROP) // 2, (h - CROP) // 2
+    return np.asarray(gray.crop((x, y, x + CROP, y + CROP)), dtype=np.float32) / 255.0
+
+
+def jpeg_traits(img: Image.Image):
+    tables = getattr(img, "quantization", None) or {}
+    if img.format != "JPEG" or not tables:
+        return [0.0, 0.0, 0.0, 0.0]
+    luma = np.asarray(tables.get(0, []), dtype=np.float32)
+    chroma = np.asarray(tables.get(1, tables.get(0, [])), dtype=np.float32)
+    return [1.0, float(luma.mean()), float(luma[0]), float(chroma.mean())]
+
+
+def spectrum_features(crops: np.ndarray) -> np.ndarray:
+    """Radial power spectrum bands, log-log slope and high/low energy ratio for a (B, CROP, CROP) batch."""
+    centered = crops - crops.mean(axis=(1, 2), keepdims=True)
+    power = np.abs(np.fft.rfft2(centered)) ** 2
+    flat = power.reshape(len(crops), -1)
+    bands = np.stack([np.bincount(BINS.ravel(), weights=row, minlength=N_BANDS) for row in flat])
+    bands = np.log1p(bands / BIN_COUNTS)
+    centers = np.log((np.arange(N_BANDS) + 0.5) / N_BANDS)
+    slope = np.polyfit(centers, bands.T, 1)[0]
+    half = N_BANDS // 2
+    high_ratio = bands[:, half:].sum(axis=1) / np.maximum(bands[:, :half].sum(axis=1), 1e-6)
+    return np.column_stack([bands, slope, high_ratio])
+
+
+def residual_features(crops: np.ndarray) -> np.ndarray:
+    """Statistics of the residual left after subtracting a 4-neighbour mean."""
+    c = crops[:, 1:-1, 1:-1]
+    neigh = 0.25 * (crops[:, :-2, 1:-1] + crops[:, 2:, 1:-1] + crops[:, 1:-1, :-2] + crops[:, 1:-1, 2:])
+    res = (c - neigh).reshape(len(crops), -1)
+    std = res.std(axis=1)
+    mean_abs = np.abs(res).mean(axis=1)
+    centered = res - res.mean(axis=1, keepdims=True)
+    kurt = (centered ** 4).mean(axis=1) / np.maximum(std ** 4, 1e-12)
+    return np.column_stack([std, mean_abs, kurt])
+
+
+def compute_batch(paths):
+    """Worker entry point: returns (ok_mask, features) for one batch of paths."""
+    crops, extra, ok = [], [], []
+    for p in paths:
+        try:
+            with Image.open(p) as img:
+                img.load()
+                crops.append(center_crop_gray(img))
+                w, h = img.size
+                extra.append(jpeg_traits(img) + [float(np.log(w / h))])
+            ok.append(True)
+        except Exception as e:
+            print(f"Failed to read {p}: {e}")
+            ok.append(False)
+    if not crops:
+        return ok, np.zeros((0, len(FEATURE_NAMES)), dtype=np.float32)
+    crops = np.stack(crops)
+    feats = np.column_stack([spectrum_features(crops), residual_features(crops), np.asarray(extra)])
+    return ok, feats.astype(np.float32)
+
+
+def standardize(features: np.ndarray) -> np.ndarray:
+    mu = features.mean(axis=0)
+    sigma = features.std(axis=0)
+    sigma[sigma == 0] = 1.0
+    return (features - mu) / sigma
+
+
+def nearest_fakes(r: np.ndarray, f: np.ndarray, k: int, chunk: int = 1024):
+    """Euclidean k-NN from every (standardized) real row to the fake rows.
+    Returns (indices, distances) of shape (n_real, min(k, n_fake)) and the nearest-real distance per fake.
+    """
+    k = min(k, len(f))
+    idx = np.empty((len(r), k), dtype=np.int32)
+    dist = np.empty((len(r), k), dtype=np.float32)
+    fake_min = np.full(len(f), np.inf, dtype=np.float32)
+    f_sq = (f * f).sum(axis=1)
+    for start in range(0, len(r), chunk):
+        block = r[start:start + chunk]
+        d2 = (block * block).sum(axis=1)[:, None] + f_sq[None, :] - 2.0 * block @ f.T
+        d = np.sqrt(np.maximum(d2, 0.0))
+        part = np.argpartition(d, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(d, part, axis=1).argsort(axis=1)
+        part = np.take_along_axis(part, order, axis=1)
+        idx[start:start + len(block)] = part
+        dist[start:start + len(block)] = np.take_along_axis(d, part, axis=1)
+        fake_min = np.minimum(fake_min, d.min(axis=0))
+    return idx, dist, fake_min
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=resource_path(DATA_DIRNAME), help="dataset root")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch", type=int, default=32, help="images per worker task")
+    parser.add_argument("--neighbours", type=int, default=8, help="fake neighbours kept per real image")
+    args = parser.parse_args()
+
+    real_map, fake_map = index_dataset(args.data)
+    categories = sorted(real_map.keys())
+    if not categories:
+        print(f"No valid dataset found in {args.data}.")
+        sys.exit(1)
+
+    entries = []  # (path, is_real, category index)
+    for ci, c in enumerate(categories):
+        entries += [(p, True, ci) for p in real_map[c]]
+        entries += [(p, False, ci) for p in fake_map[c]]
+
+    t0 = time.perf_counter()
+    paths = [e[0] for e in entries]
+    batches = [paths[i:i + args.batch] for i in range(0, len(paths), args.batch)]
+    ok_mask, chunks = [], []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for ok, feats in pool.map(compute_batch, batches):
+            ok_mask += ok
+            chunks.append(feats)
+    features = np.vstack(chunks)
+    entries = [e for e, ok in zip(entries, ok_mask) if ok]
+    print(f"Extracted {len(entries)} images in {time.perf_counter() - t0:.1f}s")
+
+    is_real = np.array([e[1] for e in entries], dtype=bool)
+    category = np.array([e[2] for e in entries], dtype=np.int16)
+    rel_paths = np.array([os.path.relpath(e[0], args.data) for e in entries])
+
+    real_rows = np.flatnonzero(is_real)
+    fake_rows = np.flatnonzero(~is_real)
+    if len(real_rows) == 0 or len(fake_rows) == 0:
+        print("Need both real and fake images to build the neighbour index.")
+        sys.exit(1)
+    z = standardize(features)
+    nn_idx, nn_dist, fake_min = nearest_fakes(z[real_rows], z[fake_rows], args.neighbours)
+
+    # Same-category rounds need neighbours from the real image's own category; filtering the
+    # global list afterwards often leaves none. Rows are padded with -1 when a category has
+    # fewer fakes than --neighbours.
+    nn_fake_cat = np.full((len(real_rows), args.neighbours), -1, dtype=np.int32)
+    real_cat = category[real_rows]
+    for ci in range(len(categories)):
+        positions = np.flatnonzero(real_cat == ci)
+        fakes = fake_rows[category[fake_rows] == ci]
+        if len(positions) == 0 or len(fakes) == 0:
+            continue
+        idx, _, _ = nearest_fakes(z[real_rows[positions]], z[fakes], args.neighbours)
+        nn_fake_cat[positions, :idx.shape[1]] = fakes[idx]
+
+    # Difficulty: closeness to the nearest image of the other class (1 = indistinguishable)
+    nearest = np.empty(len(entries), dtype=np.float32)
+    nearest[real_rows] = nn_dist[:, 0]
+    nearest[fake_rows] = fake_min
+    difficulty = 1.0 / (1.0 + nearest)
+
+    columns = {f"feat_{name}": features[:, i] for i, name in enumerate(FEATURE_NAMES)}
+    out_path = os.path.join(args.data, FEATURES_FILENAME)
+    np.savez(
+        out_path,
+        path=rel_paths,
+        is_real=is_real,
+        category=category,
+        categories=np.array(categories),
+        difficulty=difficulty.astype(np.float32),
+        nn_fake=fake_rows[nn_idx].astype(np.int32),  # row numbers, not positions in fake_rows
+        nn_dist=nn_dist,
+        nn_fake_cat=nn_fake_cat,
+        real_rows=real_rows.astype(np.int32),
+        **columns,
+    )
+    print(f"Wrote {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Offline thumbnails for progressive image display.
+
+Writes a tiny version of every dataset image, already framed like the round images
+(scale_to_fill_width_centered at 1/THUMB_DIVISOR of the round size), to data/thumbs.npy,
+or to <name>_thumbs.npy next to a dataset zip, with the dataset keys in a *_keys.npy
+beside it. The game memory-maps these, shows them at once and swaps in the
+full-quality image when the background load finishes.
+
+    python build_thumbnails.py [--data data|data.zip] [--batch 32]
+"""
+import sys
+import time
+import zipfile
+import argparse
+
+import numpy as np
+
+from main import (
+    CANVAS_WIDTH, CANVAS_HEIGHT, TOP_BAR_H, MIDDLE_GAP, DATA_DIRNAME, THUMB_DIVISOR, CANVAS_BG,
+    resource_path, index_dataset, ZipDataset, dataset_key, thumbnails_path, thumbnail_keys_path, open_image,
+    scale_batch_to_fill_width_centered,
+)
+
+
+def thumbnail_size():
+    return (CANVAS_WIDTH - MIDDLE_GAP) // 2 // THUMB_DIVISOR, (CANVAS_HEIGHT - TOP_BAR_H) // THUMB_DIVISOR
+
+
+def build_batch(images, out: np.ndarray, rgba: np.ndarray):
+    """Frame a batch of images into out (N, h, w, 3), with the letterbox bands in the canvas colour.
+    rgba is the (N, h, w, 4) scaling buffer, reused across batches.
+    """
+    n, h, w, _ = out.shape
+    scale_batch_to_fill_width_centered(images, w, h, out=rgba)
+    out[:] = rgba[..., :3]
+    out[rgba[..., 3] == 0] = CANVAS_BG
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=resource_path(DATA_DIRNAME), help="dataset folder or zip")
+    parser.add_argument("--batch", type=int, default=32, help="images scaled per batch")
+    args = parser.parse_args()
+
+    archive = ZipDataset(args.data) if zipfile.is_zipfile(args.data) else None
+    real_map, fake_map = (archive.real_map, archive.fake_map) if archive else index_dataset(args.data)
+    paths = [p for m in (real_map, fake_map) for files in m.values() for p in files]
+    if not paths:
+        print(f"No valid dataset found in {args.data}.")
+        sys.exit(1)
+
+    tw, th = thumbnail_size()
+    # Decoding at a reduced JPEG scale is plenty for a thumbnail this small
+    draft = (tw * 4, th * 4)
+    t0 = time.perf_counter()
+    keys, chunks = [], []
+    rgba = np.empty((args.batch, th, tw, 4), dtype=np.uint8)
+    for start in range(0, len(paths), args.batch):
+        images = []
+        for p in paths[start:start + args.batch]:
+            try:
+                img = open_image(archive.open(p) if archive else p, draft)
+                img.load()
+                images.append(img)
+                keys.append(dataset_key(p))
+            except Exception as e:
+                print(f"Failed to read {p}: {e}")
+        if images:
+            out = np.empty((len(images), th, tw, 3), dtype=np.uint8)
+            build_batch(images, out, rgba[:len(images)])
+            chunks.append(out)
+    if archive:
+        archive.close()
+    if not chunks:
+        print("No readable images.")
+        sys.exit(1)
+    print(f"Built {len(keys)} thumbnails ({tw}x{th}) in {time.perf_counter() - t0:.1f}s")
+
+    out_path = thumbnails_path(args.data)
+    # Plain .npy (not .npz) so the game can memory-map the pixels instead of loading them
+    np.save(out_path, np.concatenate(chunks))
+    np.save(thumbnail_keys_path(out_path), np.array(keys))
+    print(f"Wrote {out_path}")
+
+
+if __name__ == "__main__":
+    main()
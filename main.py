@@ -1,9 +1,19 @@
+import io
 import os
 import sys
 import json
+import time
+import bisect
 import random
+import threading
+import weakref
+import zipfile
+import argparse
 import pygame
+import numpy as np
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from PIL import Image, ExifTags
 
 # -----------------------------
@@ -13,10 +23,17 @@ CANVAS_WIDTH = 1600
 CANVAS_HEIGHT = 900
 TOP_BAR_H = 80
 FPS = 60
+# Static screens block on input instead of redrawing at FPS; this caps how long one wait lasts
+IDLE_WAIT_MAX_MS = 1000
 SESSION_TIME_SEC = 60.0
+# A new pair accepts guesses once it has been on screen this long (replaces a fixed cooldown after each click)
+MIN_PAIR_VIEW_MS = 400
 PASS_BTN_SIZE = (320, 110)
 MIDDLE_GAP = PASS_BTN_SIZE[0] + 60  # space between left/right images so PASS fits in the middle
 DATA_DIRNAME = "data"
+# Distributed dataset zip, used when the data folder is missing (or pass --data <zip>)
+DATA_ARCHIVE = "data.zip"
+ARCHIVE_READ_AHEAD = 256 * 1024  # bytes buffered per read from the archive
 LEADERBOARD_FILE = "leaderboard.json"
 # Use separate leaderboards per difficulty
 LEADERBOARD_FILE_NORMAL = "leaderboard_normal.json"
@@ -26,6 +43,28 @@ ALLOWED_EXTS = {".png", ".jpg", ".jpeg", ".bmp", ".webp"}
 # Toggle: if True, real and fake can come from different random categories
 RANDOM_CATEGORY = True
 
+# Offline image features (see build_features.py), stored inside the data folder
+FEATURES_FILENAME = "features.npz"
+# Toggle: if True and the features file exists, pair each real image with a similar-looking fake
+MATCH_BY_FEATURES = False
+
+# Low-resolution thumbnails (see build_thumbnails.py), shown while the full images load in the
+# background. Stored inside the data folder, or next to the dataset zip as <name>_thumbs.npy,
+# uncompressed so the game can memory-map it, with the dataset keys in a *_keys.npy beside it
+THUMBS_FILENAME = "thumbs.npy"
+THUMB_DIVISOR = 10  # thumbnails are the round image size divided by this
+
+# Metrics export for fleet monitoring (off by default, see --metrics-port / --metrics-file)
+METRICS_PORT = None
+METRICS_FILE = None
+METRICS_INTERVAL_SEC = 15.0
+
+# Presentation backend: "surface" composites in software and smoothscales to the display,
+# "sdl2" uses an SDL Renderer (GPU when available, software renderer otherwise),
+# "sdl2-software" forces the SDL software renderer
+RENDER_BACKEND = "surface"
+RENDER_BACKENDS = ("surface", "sdl2", "sdl2-software")
+
 # Colors
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -35,6 +74,7 @@ GREEN = (50, 180, 90)
 RED = (200, 60, 60)
 YELLOW = (245, 220, 40)
 SEMI_BLACK = (0, 0, 0, 170)
+CANVAS_BG = (25, 25, 25)
 
 
 # -----------------------------
@@ -109,6 +149,147 @@ def index_dataset(data_root: str):
     return real_map, fake_map
 
 
+def index_archive(archive: zipfile.ZipFile):
+    """Same as index_dataset, for zip members laid out as .../real/<cat>/<file> and
+    .../fake/<cat>/<file> under any top-level folder. Values are member names.
+    """
+    found = {"real": {}, "fake": {}}
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        parts = info.filename.split("/")
+        if len(parts) < 3 or parts[0] == "__MACOSX":
+            continue
+        kind, cat, name = parts[-3], parts[-2], parts[-1]
+        if kind not in found or name.startswith("."):
+            continue
+        _, ext = os.path.splitext(name.lower())
+        if ext in ALLOWED_EXTS:
+            found[kind].setdefault(cat, []).append(info.filename)
+
+    real_map = {}
+    fake_map = {}
+    for c in sorted(set(found["real"]).intersection(found["fake"])):
+        real_map[c] = found["real"][c]
+        fake_map[c] = found["fake"][c]
+    return real_map, fake_map
+
+
+class ZipDataset:
+    """Dataset read straight from the distributed zip, without extracting it. The central
+    directory is indexed once; members are read on demand through a buffered file handle.
+    """
+
+    def __init__(self, path: str, read_ahead: int = ARCHIVE_READ_AHEAD):
+        self.path = path
+        self.file = open(path, "rb", buffering=read_ahead)
+        self.zip = zipfile.ZipFile(self.file)
+        self.real_map, self.fake_map = index_archive(self.zip)
+
+    def open(self, member: str):
+        return io.BytesIO(self.zip.read(member))
+
+    def close(self):
+        self.zip.close()
+        self.file.close()
+
+
+def load_feature_neighbours(data_root: str, fake_paths):
+    """Load the real->fake nearest-neighbour indexes written by build_features.py.
+    Returns ({real_path: [fake_path, ...]} over all categories, the same within each real
+    image's category), ordered from most to least similar and limited to fake_paths, or None.
+    """
+    path = os.path.join(data_root, FEATURES_FILENAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            paths = [os.path.join(data_root, p) for p in data["path"]]
+            real_rows = data["real_rows"]
+            nn_fake = data["nn_fake"]
+            nn_fake_cat = data["nn_fake_cat"]
+    except Exception as e:
+        print(f"Failed to load features {path} (rebuild it with build_features.py): {e}")
+        return None
+    # Drop fakes that are no longer in the dataset, once here rather than every round
+    known = set(fake_paths)
+
+    def neighbours(rows):
+        return {paths[r]: [paths[f] for f in row if f >= 0 and paths[f] in known] for r, row in zip(real_rows, rows)}
+
+    return neighbours(nn_fake), neighbours(nn_fake_cat)
+
+
+def dataset_key(path: str) -> str:
+    """Return 'real|fake/<cat>/<file>' for a dataset path or archive member name."""
+    return "/".join(path.replace(os.sep, "/").split("/")[-3:])
+
+
+def thumbnails_path(data_root: str) -> str:
+    if os.path.isdir(data_root):
+        return os.path.join(data_root, THUMBS_FILENAME)
+    return os.path.splitext(data_root)[0] + "_" + THUMBS_FILENAME
+
+
+def thumbnail_keys_path(path: str) -> str:
+    return os.path.splitext(path)[0] + "_keys.npy"
+
+
+def load_thumbnails(path: str):
+    """Open the thumbnails written by build_thumbnails.py.
+    Returns {dataset_key: (H, W, 3) uint8 array}, or None. The pixels are memory-mapped,
+    so only the thumbnails actually shown are read from disk.
+    """
+    keys_path = thumbnail_keys_path(path)
+    if not os.path.exists(path) or not os.path.exists(keys_path):
+        return None
+    try:
+        keys = np.load(keys_path)
+        pixels = np.load(path, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        print(f"Failed to load thumbnails {path}: {e}")
+        return None
+    if len(keys) != len(pixels):
+        print(f"Thumbnails {path} don't match {keys_path}; re-run build_thumbnails.py")
+        return None
+    return dict(zip(keys.tolist(), pixels))
+
+
+def open_image(source, draft_size=None) -> Image.Image:
+    """Open an image file or file object with Pillow, apply its EXIF orientation and return
+    it as RGB. Transparent images are flattened onto the canvas background, since the round
+    buffers are opaque. draft_size lets JPEG decoding skip detail a small target won't need.
+    """
+    img_pil = Image.open(source)
+    if draft_size is not None:
+        img_pil.draft("RGB", draft_size)
+
+    try:
+        for orientation in ExifTags.TAGS.keys():
+            if ExifTags.TAGS[orientation] == 'Orientation':
+                break
+
+        exif = img_pil._getexif()
+
+        if exif is not None and orientation in exif:
+            if exif[orientation] == 3:
+                img_pil = img_pil.rotate(180, expand=True)
+            elif exif[orientation] == 6:
+                img_pil = img_pil.rotate(270, expand=True)
+            elif exif[orientation] == 8:
+                img_pil = img_pil.rotate(90, expand=True)
+    except (AttributeError, KeyError, IndexError):
+        # cases: image don't have getexif
+        pass
+
+    if img_pil.mode == 'RGBA':
+        background = Image.new('RGBA', img_pil.size, CANVAS_BG + (255,))
+        img_pil = Image.alpha_composite(background, img_pil).convert('RGB')
+    elif img_pil.mode != 'RGB':  # L, P, etc. Convert to RGB to be safe.
+        img_pil = img_pil.convert('RGB')
+    return img_pil
+
+
 def scale_to_cover(image: pygame.Surface, target_w: int, target_h: int) -> pygame.Surface:
     iw, ih = image.get_width(), image.get_height()
     if iw == 0 or ih == 0:
@@ -141,22 +322,1153 @@ def scale_to_fill_width_centered(image: pygame.Surface, target_w: int, target_h:
     return target
 
 
+class SurfacePool:
+    """Free lists of same-size opaque surfaces, so the rect-sized round buffers of each
+    pair are recycled instead of allocated and dropped every round. Only these target
+    buffers are pooled: decoding and scaling still use per-image scratch memory.
+    """
+
+    def __init__(self):
+        self.free = {}
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, size) -> pygame.Surface:
+        size = tuple(size)
+        stack = self.free.get(size)
+        if stack:
+            self.reused += 1
+            return stack.pop()
+        self.allocated += 1
+        return pygame.Surface(size).convert()
+
+    def release(self, surf: pygame.Surface | None):
+        if surf is not None:
+            self.free.setdefault(surf.get_size(), []).append(surf)
+
+    def report(self) -> str:
+        return f"Round buffers (pooled): {self.allocated} allocated, {self.reused} reused"
+
+
+# -----------------------------
+# Batch scaling
+# -----------------------------
+# Bulk counterparts of scale_to_fill_width_centered / scale_to_cover for cache building
+# and the background image loader (which runs them without a display).
+# Frames of the preallocated output batch are wrapped as surfaces sharing its memory, so
+# smoothscale writes straight into them instead of into new target Surfaces. Sources at
+# least twice the scaled size are first shrunk by an integer factor with Pillow's reduce(),
+# so smoothscale only reads about as many pixels as it writes; this is several times faster
+# on camera-sized images and lands within a couple of levels of the per-surface result.
+# Pass Pillow images where possible: an array has to be copied before Pillow can reduce it.
+
+def _image_size(image):
+    return image.size if isinstance(image, Image.Image) else (image.shape[1], image.shape[0])
+
+
+def _source_surface(image, scaled_size):
+    # (H, W, 3) array or Pillow image -> 32-bit RGBX surface (what smoothscale wants), box-reduced
+    # by the largest integer factor that still leaves it at least scaled_size. Needs no display.
+    # Returns the pixel data too, since the surface only borrows it.
+    iw, ih = _image_size(image)
+    factor = min(iw // scaled_size[0], ih // scaled_size[1])
+    if factor > 1:
+        image = (image if isinstance(image, Image.Image) else Image.fromarray(image)).reduce(factor)
+    if isinstance(image, Image.Image):
+        data = image.convert("RGBX").tobytes()
+    else:
+        data = np.empty(image.shape[:2] + (4,), dtype=np.uint8)
+        data[..., :3] = image
+        data[..., 3] = 255
+    size = _image_size(image)
+    return pygame.image.frombuffer(data, size, "RGBX"), data
+
+
+class _ScaleScratch:
+    """Buffer-backed frames reused across a batch, one per scaled size. Images that get
+    cropped are scaled whole into one of these, then the visible part is copied out.
+    """
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.frames = {}
+
+    def scale(self, image, size):
+        """Return the (pixels, surface) frame holding image scaled to size."""
+        if size not in self.frames:
+            pixels = np.empty((size[1], size[0], 4), dtype=np.uint8)
+            self.frames[size] = (pixels, pygame.image.frombuffer(pixels, size, self.fmt))
+        pixels, surf = self.frames[size]
+        src, _data = _source_surface(image, size)
+        pygame.transform.smoothscale(src, size, surf)
+        return pixels, surf
+
+
+def scale_batch_to_fill_width_centered(images, target_w: int, target_h: int, out: np.ndarray | None = None) -> np.ndarray:
+    """Batched counterpart of scale_to_fill_width_centered for (H, W, 3) arrays or Pillow images.
+    Writes into out, an (N, target_h, target_w, 4) RGBA uint8 buffer, allocating it if needed.
+    Letterbox bands are left fully transparent, like the SRCALPHA target surface.
+    """
+    n = len(images)
+    if out is None:
+        out = np.empty((n, target_h, target_w, 4), dtype=np.uint8)
+    scratch = _ScaleScratch("RGBA")
+    for i, image in enumerate(images):
+        iw, ih = _image_size(image)
+        if iw == 0 or ih == 0:
+            out[i] = 0
+            continue
+        new_h = max(1, int(ih * (target_w / iw)))
+        y = (target_h - new_h) // 2
+        if y >= 0:
+            out[i, :y] = 0
+            out[i, y + new_h:] = 0
+            frame = pygame.image.frombuffer(out[i], (target_w, target_h), "RGBA")
+            src, _data = _source_surface(image, (target_w, new_h))
+            pygame.transform.smoothscale(src, (target_w, new_h), frame.subsurface((0, y, target_w, new_h)))
+        else:
+            out[i] = scratch.scale(image, (target_w, new_h))[0][-y:-y + target_h]
+        out[i, max(0, y):max(0, y) + new_h, :, 3] = 255
+    return out
+
+
+def scale_batch_to_cover(images, target_w: int, target_h: int, out: np.ndarray | None = None) -> np.ndarray:
+    """Batched counterpart of scale_to_cover for (H, W, 3) arrays or Pillow images.
+    Writes into out, an (N, target_h, target_w, 3) RGB uint8 buffer, allocating it if needed.
+    """
+    n = len(images)
+    if out is None:
+        out = np.empty((n, target_h, target_w, 3), dtype=np.uint8)
+    scratch = _ScaleScratch("RGBX")
+    for i, image in enumerate(images):
+        iw, ih = _image_size(image)
+        if iw == 0 or ih == 0:
+            out[i] = 0
+            continue
+        scale = max(target_w / iw, target_h / ih)
+        new_w, new_h = int(iw * scale), int(ih * scale)
+        x = (target_w - new_w) // 2
+        y = (target_h - new_h) // 2
+        left, top = max(0, -x), max(0, -y)
+        vis_w, vis_h = min(target_w, new_w - left), min(target_h, new_h - top)
+        dx, dy = max(0, x), max(0, y)
+        if vis_w < target_w or vis_h < target_h:  # rounding can leave a 1px edge
+            out[i] = 0
+        # 24-bit smoothscale is slow, so scale at 32 bits and let SDL convert the visible part
+        _, scaled = scratch.scale(image, (new_w, new_h))
+        frame = pygame.image.frombuffer(out[i], (target_w, target_h), "RGB")
+        frame.blit(scaled, (dx, dy), (left, top, vis_w, vis_h))
+    return out
+
+
+# -----------------------------
+# Session recording / replay
+# -----------------------------
+# Only these event types drive the game, everything else is left out of recordings
+RECORDED_EVENTS = {
+    pygame.QUIT: (),
+    pygame.KEYDOWN: ("key", "unicode", "mod"),
+    pygame.MOUSEBUTTONDOWN: ("button", "pos"),
+    pygame.MOUSEMOTION: ("pos",),
+}
+
+
+def event_to_record(event):
+    attrs = {name: getattr(event, name) for name in RECORDED_EVENTS[event.type]}
+    if "pos" in attrs:
+        attrs["pos"] = list(attrs["pos"])
+    return [pygame.event.event_name(event.type), attrs]
+
+
+def record_to_event(record):
+    name, attrs = record
+    event_type = next(t for t in RECORDED_EVENTS if pygame.event.event_name(t) == name)
+    if "pos" in attrs:
+        attrs = dict(attrs, pos=tuple(attrs["pos"]))
+    return pygame.event.Event(event_type, **attrs)
+
+
+class SessionRecorder:
+    """Writes a replayable recording as JSON lines: a header with the seed and screen
+    size, then one line per frame with the game clock and the input events handled in it.
+    Frames where the full-quality pair replaced its thumbnails are marked "swap", since
+    when that happens depends on the loader threads rather than on the input.
+    """
+    version = 2
+
+    def __init__(self, path: str, seed: int, screen_size, start_ms: int):
+        self.file = open(path, "w", encoding="utf-8")
+        self.write({"version": self.version, "seed": seed, "screen": list(screen_size), "start_ms": start_ms})
+
+    def write(self, obj):
+        self.file.write(json.dumps(obj, separators=(",", ":"), ensure_ascii=False) + "\n")
+
+    def frame(self, t_ms: int, events, swap: bool = False):
+        record = {"t": t_ms}
+        recorded = [event_to_record(e) for e in events if e.type in RECORDED_EVENTS]
+        if recorded:
+            record["ev"] = recorded
+        if swap:
+            record["swap"] = 1
+        self.write(record)
+
+    def close(self):
+        self.file.close()
+
+
+class ReplayClock:
+    """Game clock for replays: returns whatever time the replayed frame was recorded at."""
+
+    def __init__(self, start_ms: int):
+        self.t = start_ms
+
+    def __call__(self) -> int:
+        return self.t
+
+
+def percentile(values, q: float):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+
+class LatencyTracker:
+    """Latency of the guess/pass path, from handling the input event to loading the next
+    pair and to the display flip that shows it in full quality, plus the per-round time to
+    the first flip showing any of it. Times come from time.perf_counter().
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.load_ms = []
+        self.total_ms = []
+        self.coalesced = 0  # extra actions in the same burst, merged into the first
+        self.rejected = 0  # actions arriving before the pair was viewable
+        self.pending = None
+        self.first_pixel_ms = []  # per round, from loading the pair to the first flip showing it
+
+    def input(self, t: float):
+        self.pending = [t, None]
+
+    def loaded(self, t: float):
+        if self.pending is not None:
+            self.pending[1] = t
+
+    def first_pixel(self, t_requested: float, t: float):
+        self.first_pixel_ms.append((t - t_requested) * 1000.0)
+
+    def presented(self, t: float):
+        if self.pending is None or self.pending[1] is None:
+            return
+        t_input, t_loaded = self.pending
+        self.load_ms.append((t_loaded - t_input) * 1000.0)
+        self.total_ms.append((t - t_input) * 1000.0)
+        self.pending = None
+
+    def report(self) -> str:
+        if self.first_pixel_ms:
+            first = (f"Time to first pixel over {len(self.first_pixel_ms)} rounds: "
+                     f"median={percentile(self.first_pixel_ms, 50):.1f}ms p99={percentile(self.first_pixel_ms, 99):.1f}ms")
+        else:
+            first = "Time to first pixel: no samples"
+        if not self.total_ms:
+            return f"Input latency: no samples\n{first}"
+        return (f"Input latency over {len(self.total_ms)} actions: "
+                f"to flip p50={percentile(self.total_ms, 50):.1f}ms p90={percentile(self.total_ms, 90):.1f}ms "
+                f"p99={percentile(self.total_ms, 99):.1f}ms max={max(self.total_ms):.1f}ms; "
+                f"pair load p50={percentile(self.load_ms, 50):.1f}ms p99={percentile(self.load_ms, 99):.1f}ms; "
+                f"coalesced={self.coalesced} rejected={self.rejected}\n{first}")
+
+
+# -----------------------------
+# Metrics
+# -----------------------------
+# The game loop is the only writer; exporter threads only read. Plain attribute updates
+# keep observe() to a bisect and two additions, with no locks on the frame path.
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, n: int = 1):
+        self.value += n
+
+    def exposition(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        counts = list(self.counts)
+        total = 0
+        for le, n in zip(self.buckets, counts):
+            total += n
+            lines.append(f'{self.name}_bucket{{le="{le:g}"}} {total}')
+        total += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {total}')
+        lines.append(f"{self.name}_sum {self.sum:.6f}")
+        lines.append(f"{self.name}_count {total}")
+        return lines
+
+
+def resident_memory_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+    except Exception:
+        return 0
+
+
+class Metrics:
+    """Counters and histograms for frame time, image loading and sessions, rendered in the
+    Prometheus text format.
+    """
+
+    def __init__(self):
+        self.frame_time = Histogram("fakereal_frame_time_seconds", "Frame time from clock.tick on animated screens.",
+                                    (0.008, 0.012, 0.016, 0.018, 0.020, 0.025, 0.033, 0.050, 0.100, 0.250))
+        self.image_load = Histogram("fakereal_image_load_seconds", "Time to load and scale one round image.",
+                                    (0.005, 0.010, 0.020, 0.030, 0.050, 0.075, 0.100, 0.200, 0.500, 1.0))
+        self.first_pixel = Histogram("fakereal_first_pixel_seconds", "Time from loading a pair to the flip that first shows it.",
+                                     (0.002, 0.005, 0.010, 0.016, 0.025, 0.033, 0.050, 0.100, 0.200, 0.500))
+        self.image_load_failures = Counter("fakereal_image_load_failures_total", "Images replaced by the placeholder.")
+        self.sessions = Counter("fakereal_sessions_total", "Completed play sessions.")
+        self.rounds_per_session = Histogram("fakereal_rounds_per_session", "Rounds played per session.",
+                                            (5, 10, 20, 30, 40, 50, 75, 100))
+        self.started = time.time()
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in (self.frame_time, self.image_load, self.first_pixel, self.image_load_failures, self.sessions,
+                       self.rounds_per_session):
+            lines += metric.exposition()
+        lines += [
+            "# HELP process_resident_memory_bytes Resident memory size in bytes.",
+            "# TYPE process_resident_memory_bytes gauge",
+            f"process_resident_memory_bytes {resident_memory_bytes()}",
+            "# HELP process_start_time_seconds Start time of the process since unix epoch in seconds.",
+            "# TYPE process_start_time_seconds gauge",
+            f"process_start_time_seconds {self.started:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Serves Metrics on http://127.0.0.1:<port>/metrics and/or rewrites a snapshot file
+    every interval, from daemon threads.
+    """
+
+    def __init__(self, metrics: Metrics, port: int | None = None, snapshot_path: str | None = None,
+                 interval_sec: float = METRICS_INTERVAL_SEC):
+        self.metrics = metrics
+        self.server = None
+        self.snapshot_path = snapshot_path
+        self.interval_sec = interval_sec
+        self.stop_event = threading.Event()
+        if port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), self.make_handler())
+            threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        if snapshot_path:
+            threading.Thread(target=self.snapshot_loop, name="metrics-file", daemon=True).start()
+
+    def make_handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def write_snapshot(self):
+        tmp = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.metrics.exposition())
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            print(f"Failed to write metrics snapshot: {e}")
+
+    def snapshot_loop(self):
+        while not self.stop_event.wait(self.interval_sec):
+            self.write_snapshot()
+
+    def close(self):
+        self.stop_event.set()
+        if self.snapshot_path:
+            self.write_snapshot()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def replay_session(path: str, stats_path: str | None = None, report_every_ms: int = 5000, backend: str = RENDER_BACKEND,
+                   data_path: str | None = None):
+    """Replay a recording headlessly as fast as possible and report per-frame timings."""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    with open(path, "r", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        frames = [json.loads(line) for line in f if line.strip()]
+    clock = ReplayClock(header["start_ms"])
+    game = FakeRealGame(seed=header["seed"], screen_size=tuple(header["screen"]), time_source=clock, backend=backend,
+                        data_path=data_path)
+    game.save_scores = False  # never touch the real leaderboards from a replay
+    # Version 1 recordings don't mark swaps: take each full pair as soon as it's pending
+    swaps_recorded = header.get("version", 1) >= 2
+
+    stats_file = open(stats_path, "w", encoding="utf-8") if stats_path else None
+    if stats_file:
+        stats_file.write("frame,t_ms,state,frame_ms\n")
+    per_state = {}
+    window = []
+    prev_t = header["start_ms"]
+    next_report = prev_t + report_every_ms
+    for i, rec in enumerate(frames):
+        if not game.running:
+            break
+        clock.t = rec["t"]
+        # Swap in the full pair on the recorded frame, waiting for the loaders if needed
+        game.swap_full_pair = bool(rec.get("swap")) if swaps_recorded else game.pending_pair is not None
+        events = [record_to_event(r) for r in rec.get("ev", [])]
+        t0 = time.perf_counter()
+        game.events_received_at = t0
+        game.handle_events(events)
+        game.update(rec["t"] - prev_t)
+        game.render()
+        frame_ms = (time.perf_counter() - t0) * 1000.0
+        prev_t = rec["t"]
+        per_state.setdefault(game.state, []).append(frame_ms)
+        window.append(frame_ms)
+        if stats_file:
+            stats_file.write(f"{i},{rec['t']},{game.state},{frame_ms:.3f}\n")
+        if rec["t"] >= next_report:
+            print(f"[replay] t={(rec['t'] - header['start_ms']) / 1000:.0f}s frames={len(window)} "
+                  f"mean={sum(window) / len(window):.2f}ms p95={percentile(window, 95):.2f}ms max={max(window):.2f}ms")
+            window = []
+            next_report += report_every_ms
+    if stats_file:
+        stats_file.close()
+    game.loader.shutdown(cancel_futures=True)
+    if game.archive:
+        game.archive.close()
+    pygame.quit()
+
+    print(f"Replayed {sum(len(v) for v in per_state.values())} frames from {path} (seed {header['seed']}, backend {backend})")
+    for state, values in per_state.items():
+        print(f"  {state:18s} n={len(values):6d} mean={sum(values) / len(values):7.2f}ms "
+              f"p50={percentile(values, 50):7.2f}ms p95={percentile(values, 95):7.2f}ms "
+              f"p99={percentile(values, 99):7.2f}ms max={max(values):7.2f}ms")
+    return per_state
+
+
+# -----------------------------
+# States
+# -----------------------------
+CONFIRM_KEYS = (pygame.K_RETURN, pygame.K_KP_ENTER, pygame.K_SPACE)
+
+
+def make_panel(size, radius: int, shadow: int = 8) -> pygame.Surface:
+    """Light panel with a dark border and a drop shadow, drawn once onto its own surface."""
+    w, h = size
+    surf = pygame.Surface((w + shadow, h + shadow), pygame.SRCALPHA)
+    pygame.draw.rect(surf, BLACK, pygame.Rect(shadow, shadow, w, h), border_radius=radius)
+    pygame.draw.rect(surf, (245, 245, 245), pygame.Rect(0, 0, w, h), border_radius=radius)
+    pygame.draw.rect(surf, (30, 30, 30), pygame.Rect(0, 0, w, h), width=4, border_radius=radius)
+    return surf
+
+
+def make_overlay(color) -> pygame.Surface:
+    overlay = pygame.Surface((CANVAS_WIDTH, CANVAS_HEIGHT), pygame.SRCALPHA)
+    overlay.fill(color)
+    return overlay
+
+
+def centered_text(font, text: str, y: int, color=WHITE):
+    """Render text once and return it with its canvas position, horizontally centered."""
+    surf = font.render(text, True, color)
+    return surf, (CANVAS_WIDTH // 2 - surf.get_width() // 2, y)
+
+
+class GameState:
+    """One screen of the game. The game looks the active state up by name and forwards
+    input, update and render to it. Anything only needed while the screen is visible
+    (prebuilt panels, rendered text) is built in enter() and dropped in exit().
+    """
+    name = ""
+    show_top_bar = True
+    # Animated screens redraw at FPS. Static ones are redrawn only on input or when
+    # next_redraw_ms() says they change by themselves.
+    animated = True
+    # True for the screen that shows the round images
+    shows_round = False
+    # Keyboard shortcuts and click targets both map to action names handled by on_action()
+    key_actions = {}
+
+    def __init__(self, game):
+        self.game = game
+
+    def enter(self):
+        pass
+
+    def exit(self):
+        pass
+
+    def click_targets(self):
+        """(rect, action) pairs in canvas coordinates, checked in order."""
+        return ()
+
+    def on_key(self, event):
+        action = self.key_actions.get(event.key)
+        if action:
+            self.on_action(action)
+
+    def on_click(self, pos):
+        m = self.game.screen_to_canvas(*pos)
+        if m is None:
+            return
+        for rect, action in self.click_targets():
+            if rect.collidepoint(m):
+                self.on_action(action)
+                return
+
+    def on_action(self, action: str):
+        pass
+
+    def next_redraw_ms(self, now: int):
+        """Game time at which a static screen changes without input, or None."""
+        return None
+
+    def update(self, dt_ms: int):
+        pass
+
+    def render(self, canvas: pygame.Surface):
+        pass
+
+
+class IntroState(GameState):
+    name = "intro"
+    show_top_bar = False
+    key_actions = {k: "skip" for k in CONFIRM_KEYS}
+
+    def enter(self):
+        g = self.game
+        g.intro_start_ms = g.now_ms()
+        self.layer = self.build_logo_layer()
+
+    def exit(self):
+        self.layer = None
+
+    def build_logo_layer(self):
+        g = self.game
+        if g.logo_main is None:
+            return None
+        # Determine sizes to fit
+        max_main_w = int(CANVAS_WIDTH * 0.7)
+        gap = 24
+        lm_w, lm_h = g.logo_main.get_size()
+        scale_main = min(1.0, max_main_w / max(1, lm_w))
+        main_w = int(lm_w * scale_main)
+        main_h = int(lm_h * scale_main)
+
+        if g.logo_imp is not None:
+            li_w, li_h = g.logo_imp.get_size()
+            scale_imp = 0.5
+            imp_w = int(li_w * scale_imp)
+            imp_h = int(li_h * scale_imp)
+        else:
+            imp_w = imp_h = 0
+
+        # If total too tall, scale both down
+        total_h = main_h + (gap if imp_h else 0) + imp_h
+        avail_h = int(CANVAS_HEIGHT * 0.7)
+        if total_h > avail_h and total_h > 0:
+            k = avail_h / total_h
+            main_w = int(main_w * k)
+            main_h = int(main_h * k)
+            imp_w = int(imp_w * k)
+            imp_h = int(imp_h * k)
+
+        layer = pygame.Surface((CANVAS_WIDTH, CANVAS_HEIGHT), pygame.SRCALPHA)
+        # Main logo centered, imp logo under it
+        x_main = CANVAS_WIDTH // 2 - main_w // 2
+        y_main = CANVAS_HEIGHT // 2 - (main_h + (gap if imp_h else 0) + imp_h) // 2
+        main_scaled = pygame.transform.smoothscale(g.logo_main, (max(1, main_w), max(1, main_h)))
+        layer.blit(main_scaled, (x_main, y_main))
+        if g.logo_imp is not None and imp_w and imp_h:
+            x_imp = CANVAS_WIDTH // 2 - imp_w // 2
+            y_imp = y_main + main_h + gap
+            imp_scaled = pygame.transform.smoothscale(g.logo_imp, (max(1, imp_w), max(1, imp_h)))
+            layer.blit(imp_scaled, (x_imp, y_imp))
+        return layer
+
+    def on_click(self, pos):
+        # Skip intro on any click, even outside the canvas
+        self.on_action("skip")
+
+    def on_action(self, action: str):
+        self.game.change_state("start_prompt")
+
+    def update(self, dt_ms: int):
+        g = self.game
+        total = g.INTRO_FADE_MS * 2 + g.INTRO_HOLD_MS
+        if g.now_ms() - g.intro_start_ms >= total:
+            g.change_state("start_prompt")
+            # Ensure idle music after intro
+            try:
+                g.set_music('idle')
+            except Exception:
+                pass
+
+    def render(self, canvas: pygame.Surface):
+        g = self.game
+        canvas.fill(BLACK)
+        if self.layer is None:
+            return
+        t = g.now_ms() - g.intro_start_ms
+        fade = g.INTRO_FADE_MS
+        hold = g.INTRO_HOLD_MS
+        total = fade * 2 + hold
+        if t < fade:
+            alpha = int(255 * (t / fade))
+        elif t < fade + hold:
+            alpha = 255
+        elif t < total:
+            alpha = int(255 * (1 - (t - fade - hold) / fade))
+        else:
+            alpha = 0
+        self.layer.set_alpha(max(0, min(255, alpha)))
+        canvas.blit(self.layer, (0, 0))
+
+
+class StartPromptState(GameState):
+    name = "start_prompt"
+    animated = False
+    key_actions = {k: "next" for k in CONFIRM_KEYS}
+
+    def enter(self):
+        g = self.game
+        rect = g.start_prompt_rect
+        self.overlay = make_overlay((0, 0, 0, 200))
+        panel = make_panel(rect.size, 18)
+        # Accent header
+        header = pygame.Rect(0, 0, rect.width, 64)
+        pygame.draw.rect(panel, (29, 41, 81), header, border_radius=18)
+        pygame.draw.line(panel, (49, 61, 101), (12, header.bottom - 4), (rect.width - 12, header.bottom - 4), 3)
+        # Rules lines
+        y = 84
+        for i, line in enumerate(g.start_rules):
+            font = g.font_large if i == 0 else g.font
+            color = BLACK if i == 0 else DARK_GRAY
+            surf = font.render(line, True, color)
+            panel.blit(surf, ((rect.width - surf.get_width()) // 2, y))
+            y += surf.get_height() + (16 if i == 0 else 12)
+        self.panel = panel
+
+    def exit(self):
+        self.overlay = None
+        self.panel = None
+
+    def click_targets(self):
+        return ((self.game.start_prompt_rect, "next"),)
+
+    def on_action(self, action: str):
+        self.game.change_state("difficulty_prompt")
+
+    def render(self, canvas: pygame.Surface):
+        canvas.blit(self.overlay, (0, 0))
+        canvas.blit(self.panel, self.game.start_prompt_rect.topleft)
+
+
+class DifficultyPromptState(GameState):
+    name = "difficulty_prompt"
+    animated = False
+    key_actions = {
+        pygame.K_n: "normal", pygame.K_LEFT: "normal",  # NORMALE
+        pygame.K_d: "hard", pygame.K_RIGHT: "hard",  # DIFFICILE
+    }
+
+    def enter(self):
+        g = self.game
+        rect = g.diff_prompt_rect
+        self.overlay = make_overlay((0, 0, 0, 200))
+        panel = make_panel(rect.size, 18)
+        title = g.font_large.render("Seleziona Modalità", True, BLACK)
+        panel.blit(title, (rect.width // 2 - title.get_width() // 2, 30))
+        desc_lines = [
+            "Modalità 1: le due foto appartengono alla stessa categoria (più difficile).",
+            "Modalità 2: le due foto appartengono a categorie diverse.",
+            "Clicca una modalità per iniziare.",
+        ]
+        y = 30 + title.get_height() + 16
+        for line in desc_lines:
+            s = g.font.render(line, True, DARK_GRAY)
+            panel.blit(s, (rect.width // 2 - s.get_width() // 2, y))
+            y += s.get_height() + 6
+        self.panel = panel
+        # Buttons, prebuilt in both hover variants
+        self.buttons = [
+            (g.diff_normal_rect, self.build_button(g.diff_normal_rect.size, "Modalità 1")),
+            (g.diff_hard_rect, self.build_button(g.diff_hard_rect.size, "Modalità 2")),
+        ]
+
+    def exit(self):
+        self.overlay = None
+        self.panel = None
+        self.buttons = None
+
+    def build_button(self, size, text: str):
+        variants = {}
+        t = self.game.font_large.render(text, True, BLACK)
+        for hovered, color in ((False, (220, 220, 220)), (True, (235, 235, 235))):
+            surf = pygame.Surface(size, pygame.SRCALPHA)
+            r = surf.get_rect()
+            pygame.draw.rect(surf, color, r, border_radius=16)
+            pygame.draw.rect(surf, BLACK, r, width=3, border_radius=16)
+            surf.blit(t, (r.centerx - t.get_width() // 2, r.centery - t.get_height() // 2))
+            variants[hovered] = surf
+        return variants
+
+    def click_targets(self):
+        g = self.game
+        return ((g.diff_normal_rect, "normal"), (g.diff_hard_rect, "hard"))
+
+    def on_action(self, action: str):
+        self.game.choose_difficulty(hard=(action == "hard"))
+
+    def render(self, canvas: pygame.Surface):
+        canvas.blit(self.overlay, (0, 0))
+        canvas.blit(self.panel, self.game.diff_prompt_rect.topleft)
+        cm = self.game.mouse_canvas_pos()
+        for rect, variants in self.buttons:
+            canvas.blit(variants[bool(cm and rect.collidepoint(*cm))], rect.topleft)
+
+
+class CountdownState(GameState):
+    name = "countdown"
+
+    def enter(self):
+        g = self.game
+        g.session_seed = g.seed_rng.randrange(2 ** 32)
+        g.rng.seed(g.session_seed)
+        self.index = 0
+        self.phase_start = g.now_ms()
+        self.overlay = make_overlay(SEMI_BLACK)
+        self.labels = []
+        for label, _ in g.countdown_sequence:
+            surf = g.font_xlarge.render(label, True, GREEN if label == "GO" else WHITE)
+            self.labels.append((surf, (CANVAS_WIDTH // 2 - surf.get_width() // 2, CANVAS_HEIGHT // 2 - surf.get_height() // 2)))
+        # Load first pair *after* difficulty is set
+        g.load_new_pair()
+        # Start background music (loop)
+        try:
+            g.set_music('game')
+        except Exception:
+            pass
+
+    def exit(self):
+        self.overlay = None
+        self.labels = None
+
+    def update(self, dt_ms: int):
+        g = self.game
+        now = g.now_ms()
+        _, dur = g.countdown_sequence[self.index]
+        if now - self.phase_start >= dur:
+            self.index += 1
+            self.phase_start = now
+            if self.index >= len(g.countdown_sequence):
+                g.change_state("playing")
+
+    def render(self, canvas: pygame.Surface):
+        # Images stay hidden during the countdown
+        canvas.blit(self.overlay, (0, 0))
+        surf, pos = self.labels[self.index]
+        canvas.blit(surf, pos)
+
+
+class PlayingState(GameState):
+    name = "playing"
+    shows_round = True
+    key_actions = {
+        pygame.K_LEFT: "left",
+        pygame.K_RIGHT: "right",
+        pygame.K_UP: "pass",
+        pygame.K_DOWN: "pass",
+    }
+
+    def enter(self):
+        g = self.game
+        g.score = 0.0
+        g.round_index = 0
+        g.session_start_ms = g.now_ms()
+        g.time_left = SESSION_TIME_SEC
+        # Ensure we have a pair ready
+        if g.left_image is None or g.right_image is None:
+            g.load_new_pair()
+        self.pass_button = {hover: g.make_pass_button(hover) for hover in (False, True)}
+        self.labels = {}
+        self.queue = []
+        g.latency.reset()
+
+    def exit(self):
+        self.pass_button = None
+        self.labels = None
+        self.queue = None
+        self.game.metrics.sessions.inc()
+        self.game.metrics.rounds_per_session.observe(self.game.round_index)
+        print(self.game.latency.report())
+        print(self.game.surface_pool.report())
+
+    def click_targets(self):
+        g = self.game
+        return ((g.pass_rect, "pass"), (g.left_rect, "left"), (g.right_rect, "right"))
+
+    def on_action(self, action: str):
+        # Queued and applied in update(), so a burst handled in one frame becomes one action
+        self.queue.append(action)
+
+    def update(self, dt_ms: int):
+        g = self.game
+        if self.queue:
+            action = self.queue[0]
+            g.latency.coalesced += len(self.queue) - 1
+            self.queue.clear()
+            if g.pair_viewable():
+                g.latency.input(g.events_received_at)
+                if action == "pass":
+                    g.handle_pass()
+                else:
+                    g.handle_guess(is_left=(action == "left"))
+            else:
+                g.latency.rejected += 1
+        elapsed = (g.now_ms() - g.session_start_ms) / 1000.0
+        g.time_left = max(0.0, SESSION_TIME_SEC - elapsed)
+        if g.time_left <= 0:
+            g.change_state("enter_name")
+
+    def image_label(self, rect: pygame.Rect, text: str):
+        # Labels only change with the pair, keep the last rendering per side
+        key = (rect.x, text)
+        if key not in self.labels:
+            self.labels = {k: v for k, v in self.labels.items() if k[0] != rect.x}
+            self.labels[key] = self.game.make_image_label(rect, text)
+        return self.labels[key]
+
+    def render(self, canvas: pygame.Surface):
+        g = self.game
+        if g.left_image is not None:
+            canvas.blit(g.left_image, g.left_rect.topleft)
+        if g.right_image is not None:
+            canvas.blit(g.right_image, g.right_rect.topleft)
+        cm = g.mouse_canvas_pos()
+        hover = cm is not None and g.pass_rect.collidepoint(*cm)
+        canvas.blit(self.pass_button[hover], g.pass_rect.topleft)
+        # Debug labels under images
+        for rect, text in ((g.left_rect, g.left_label), (g.right_rect, g.right_label)):
+            canvas.blits(self.image_label(rect, text), doreturn=False)
+
+
+class EnterNameState(GameState):
+    name = "enter_name"
+    animated = False
+
+    def enter(self):
+        g = self.game
+        g.latest_score = g.score
+        g.player_name = ""
+        # Switch back to idle music when session ends
+        try:
+            g.set_music('idle')
+        except Exception:
+            pass
+        # Result screen and name input
+        self.static = [
+            centered_text(g.font_large, "Il tempo è finito!", 150, YELLOW),
+            centered_text(g.font_large, f"Il tuo punteggio è: {g.latest_score:.1f}", 230, WHITE),
+            centered_text(g.font, "Digita il tuo nome e premi INVIO:", 320, WHITE),
+        ]
+        panel_rect = pygame.Rect(0, 0, 800, 160)
+        panel_rect.center = (CANVAS_WIDTH // 2, 500)
+        panel = make_panel(panel_rect.size, 14)
+        # Input box inside
+        self.box = pygame.Rect(panel_rect.x + 40, panel_rect.centery - 40, panel_rect.width - 80, 80)
+        local_box = self.box.move(-panel_rect.x, -panel_rect.y)
+        pygame.draw.rect(panel, WHITE, local_box, border_radius=10)
+        pygame.draw.rect(panel, BLACK, local_box, width=3, border_radius=10)
+        self.static.append((panel, panel_rect.topleft))
+        self.static.append(centered_text(g.font, "(Usa Backspace per correggere)", panel_rect.bottom + 20, GRAY))
+
+    def exit(self):
+        self.static = None
+
+    def next_redraw_ms(self, now: int):
+        # Blinking cursor toggles every 500 ms
+        return (now // 500 + 1) * 500
+
+    def on_key(self, event):
+        g = self.game
+        if event.key == pygame.K_RETURN:
+            # commit name and move to leaderboard
+            g.leaderboard_entries = g.update_leaderboard()
+            g.change_state("leaderboard")
+        elif event.key == pygame.K_BACKSPACE:
+            g.player_name = g.player_name[:-1]
+        else:
+            if len(g.player_name) < 24:
+                ch = event.unicode
+                if ch.isprintable():
+                    g.player_name += ch
+
+    def render(self, canvas: pygame.Surface):
+        g = self.game
+        canvas.blits(self.static, doreturn=False)
+        name_display = g.player_name if (g.now_ms() // 500) % 2 == 0 else g.player_name + "|"
+        txt = g.cached_text("player_name", g.font, name_display, BLACK)
+        canvas.blit(txt, (self.box.x + 16, self.box.y + (self.box.height - txt.get_height()) // 2))
+
+
+class LeaderboardState(GameState):
+    name = "leaderboard"
+    animated = False
+    key_actions = {pygame.K_RETURN: "again", pygame.K_SPACE: "again"}
+
+    def enter(self):
+        g = self.game
+        difficolta = "Modalità 2" if g.random_category else "Modalità 1"
+        self.static = [centered_text(g.font_large, f"Classifica ({difficolta})", 100, YELLOW)]
+        # Fancy list: only position and name, with alternating row shades
+        y = 200
+        for rank, e in enumerate(getattr(g, "leaderboard_entries", []), start=1):
+            name = e.get("name", "?")
+            score = e.get("score", "err")
+            row = pygame.Surface((1000, 56), pygame.SRCALPHA)
+            shade = (245, 245, 245) if rank % 2 == 0 else (230, 230, 230)
+            pygame.draw.rect(row, shade, row.get_rect(), border_radius=10)
+            pygame.draw.rect(row, (200, 200, 200), row.get_rect(), width=2, border_radius=10)
+            s = g.font.render(f"{rank:2d}.  {name[:32]} : {score}", True, BLACK)
+            row.blit(s, (20, (row.get_height() - s.get_height()) // 2))
+            self.static.append((row, (CANVAS_WIDTH // 2 - 500, y - 8)))
+            y += 64
+        if g.just_qualified:
+            self.static.append(centered_text(g.font, "Congratulazioni! Sei arrivato in Top 10!", y + 30, GREEN))
+        self.static.append(centered_text(g.font, "Premi Invio per giocare ancora, oppure Esc per uscire.", CANVAS_HEIGHT - 80, GRAY))
+
+    def exit(self):
+        self.static = None
+
+    def on_action(self, action: str):
+        # Restart flow: show rules then difficulty again
+        self.game.change_state("start_prompt")
+
+    def render(self, canvas: pygame.Surface):
+        canvas.blits(self.static, doreturn=False)
+
+
+STATES = (
+    IntroState,
+    StartPromptState,
+    DifficultyPromptState,
+    CountdownState,
+    PlayingState,
+    EnterNameState,
+    LeaderboardState,
+)
+
+
+# -----------------------------
+# Presentation backends
+# -----------------------------
+class SurfacePresenter:
+    """Composite everything on the canvas in software, then smoothscale it onto the display."""
+    name = "surface"
+
+    def __init__(self, screen_size=None):
+        if screen_size:
+            self.screen = pygame.display.set_mode(screen_size)
+        else:
+            self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+        self.size = self.screen.get_size()
+
+    def make_canvas(self) -> pygame.Surface:
+        return pygame.Surface((CANVAS_WIDTH, CANVAS_HEIGHT)).convert()
+
+    def upload_round(self, images):
+        pass
+
+    def present(self, canvas: pygame.Surface, target: pygame.Rect):
+        scaled = pygame.transform.smoothscale(canvas, (target.width, target.height))
+        self.screen.fill(BLACK)
+        self.screen.blit(scaled, target.topleft)
+        pygame.display.flip()
+
+
+class TextureCanvas:
+    """Stands in for the canvas Surface on the SDL2 backend. States draw on it with the same
+    fill/blit/blits calls; these are recorded in canvas coordinates and replayed by the
+    renderer, each surface drawn from a texture uploaded the first time it is blitted and
+    freed together with the surface. Surfaces are taken as unchanging once blitted: the
+    recycled round buffers are refreshed in place through upload().
+    """
+
+    def __init__(self, renderer, texture_cls):
+        self.renderer = renderer
+        self.texture_cls = texture_cls
+        self.textures = weakref.WeakKeyDictionary()
+        self.ops = []  # (texture or None, alpha or fill color, canvas rect or None)
+
+    def upload(self, surf: pygame.Surface):
+        texture = self.textures.get(surf)
+        if texture is not None and (texture.width, texture.height) == surf.get_size():
+            # A recycled buffer keeps its texture; only the pixels are sent again
+            texture.update(surf)
+            return texture
+        texture = self.texture_cls.from_surface(self.renderer, surf)
+        self.textures[surf] = texture
+        return texture
+
+    def fill(self, color, rect=None):
+        self.ops.append((None, color, None if rect is None else pygame.Rect(rect)))
+
+    def blit(self, source: pygame.Surface, dest):
+        if not source.get_width() or not source.get_height():
+            return  # e.g. rendered empty text; nothing to draw and SDL can't make the texture
+        texture = self.textures.get(source)
+        if texture is None:
+            texture = self.upload(source)
+        self.ops.append((texture, source.get_alpha(), pygame.Rect(dest, source.get_size())))
+
+    def blits(self, blit_sequence, doreturn=True):
+        for source, dest in blit_sequence:
+            self.blit(source, dest)
+
+
+class RendererPresenter:
+    """Present through an SDL2 Renderer. Panels, overlays, text and round images are drawn
+    from textures uploaded once (round images when load_new_pair runs); only what changed
+    is uploaded again. The renderer does the letterbox scaling and alpha blending.
+    """
+    name = "sdl2"
+
+    def __init__(self, screen_size=None, accelerated: bool = True):
+        # Only this backend needs pygame's private SDL2 bindings
+        from pygame._sdl2.video import Window, Renderer, Texture
+        # Linear filtering when textures are scaled (read by SDL when textures are created)
+        os.environ.setdefault("SDL_RENDER_SCALE_QUALITY", "1")
+        # A hidden display surface keeps convert()/convert_alpha() working
+        pygame.display.set_mode((1, 1), pygame.HIDDEN)
+        if screen_size:
+            self.window = Window("Fake vs Real", size=screen_size)
+        else:
+            self.window = Window("Fake vs Real", fullscreen_desktop=True)
+        self.renderer = None
+        if accelerated:
+            try:
+                self.renderer = Renderer(self.window, accelerated=1)
+            except Exception as e:
+                print(f"Accelerated renderer unavailable ({e}), using software renderer.")
+        if self.renderer is None:
+            self.renderer = Renderer(self.window, accelerated=0)
+        self.size = self.window.size
+        self.canvas = TextureCanvas(self.renderer, Texture)
+
+    def make_canvas(self) -> TextureCanvas:
+        return self.canvas
+
+    def upload_round(self, images):
+        # Pool buffers are reused for new pairs: their textures are refreshed in place
+        for image in images:
+            if image is not None:
+                self.canvas.upload(image)
+
+    def present(self, canvas: TextureCanvas, target: pygame.Rect):
+        r = self.renderer
+        r.draw_color = (*BLACK, 255)
+        r.clear()
+        sx = target.width / CANVAS_WIDTH
+        sy = target.height / CANVAS_HEIGHT
+        bounds = pygame.Rect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT)
+        for texture, value, rect in canvas.ops:
+            # Clip to the canvas like a Surface blit would, then map to the screen
+            clipped = bounds.clip(rect) if rect is not None else bounds
+            if not clipped.width or not clipped.height:
+                continue
+            x0, y0 = target.x + round(clipped.left * sx), target.y + round(clipped.top * sy)
+            x1, y1 = target.x + round(clipped.right * sx), target.y + round(clipped.bottom * sy)
+            dst = pygame.Rect(x0, y0, x1 - x0, y1 - y0)
+            if texture is None:
+                r.draw_color = (*value[:3], 255)
+                r.fill_rect(dst)
+            else:
+                texture.alpha = 255 if value is None else value
+                texture.draw(srcrect=clipped.move(-rect.x, -rect.y), dstrect=dst)
+        canvas.ops.clear()
+        r.present()
+
+
+def make_presenter(backend: str, screen_size=None):
+    if backend == "surface":
+        return SurfacePresenter(screen_size)
+    if backend in ("sdl2", "sdl2-software"):
+        return RendererPresenter(screen_size, accelerated=(backend == "sdl2"))
+    raise ValueError(f"Unknown render backend: {backend}")
+
+
 # -----------------------------
 # Game
 # -----------------------------
 class FakeRealGame:
-    def __init__(self):
+    def __init__(self, seed: int | None = None, record_path: str | None = None, screen_size=None, time_source=None,
+                 backend: str = RENDER_BACKEND, data_path: str | None = None,
+                 metrics_port: int | None = METRICS_PORT, metrics_file: str | None = METRICS_FILE):
         pygame.init()
+        # Clock used for all game timing; replays substitute a recorded clock
+        self.time_source = time_source or pygame.time.get_ticks
         # Init audio mixer for music/SFX
         try:
             pygame.mixer.init()
         except Exception as e:
             print(f"Mixer init failed: {e}")
         pygame.display.set_caption("Fake vs Real")
-        self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
-        self.screen_w, self.screen_h = self.screen.get_size()
+        self.presenter = make_presenter(backend, screen_size)
+        self.screen_w, self.screen_h = self.presenter.size
+        self.mouse_pos = pygame.mouse.get_pos()
 
-        self.canvas = pygame.Surface((CANVAS_WIDTH, CANVAS_HEIGHT)).convert()
+        self.canvas = self.presenter.make_canvas()
 
         # Preload audio assets
         self.music_path = resource_path("assets", "background_music.mp3")
@@ -243,21 +1555,34 @@ class FakeRealGame:
             "Per iniziare, premi Invio/Spazio o clicca qui sopra.",
         ]
 
-        # Dataset
-        self.data_root = resource_path(DATA_DIRNAME)
-        self.real_map, self.fake_map = index_dataset(self.data_root)
+        # Dataset: a data folder, or the distributed zip read in place
+        self.data_root = data_path or resource_path(DATA_DIRNAME)
+        if data_path is None and not os.path.isdir(self.data_root) and os.path.isfile(resource_path(DATA_ARCHIVE)):
+            self.data_root = resource_path(DATA_ARCHIVE)
+        self.archive = ZipDataset(self.data_root) if zipfile.is_zipfile(self.data_root) else None
+        if self.archive:
+            self.real_map, self.fake_map = self.archive.real_map, self.archive.fake_map
+        else:
+            self.real_map, self.fake_map = index_dataset(self.data_root)
         self.categories = [c for c in self.real_map.keys() if c in self.fake_map and self.real_map[c] and self.fake_map[c]]
+        # Feature index paths are relative to a data folder
+        self.fake_neighbours = None
+        if MATCH_BY_FEATURES and not self.archive:
+            fake_paths = [p for files in self.fake_map.values() for p in files]
+            self.fake_neighbours = load_feature_neighbours(self.data_root, fake_paths)
 
         if not self.categories:
-            print("No valid dataset found in ./data with matching categories under real/ and fake/.")
+            print(f"No valid dataset found in {self.data_root} with matching categories under real/ and fake/.")
             print("Exiting.")
             pygame.quit()
             sys.exit(1)
 
         # Game state
         # start with intro -> start_prompt -> difficulty_prompt -> countdown -> playing -> enter_name -> leaderboard
-        self.state = "intro"
-        self.intro_start_ms = pygame.time.get_ticks()
+        self.states = {cls.name: cls(self) for cls in STATES}
+        self.state = None
+        self.current = None
+        self.intro_start_ms = 0
         self.INTRO_FADE_MS = 1500
         self.INTRO_HOLD_MS = 1500
         self.score = 0.0
@@ -269,19 +1594,48 @@ class FakeRealGame:
         self.latest_score = 0.0
         # Difficulty toggle (session-level): default from global
         self.random_category = RANDOM_CATEGORY
-        self.last_action_time = 0  # Cooldown for choices
+        self.metrics = Metrics()
+        self.metrics_exporter = None
+        if metrics_port is not None or metrics_file:
+            try:
+                self.metrics_exporter = MetricsExporter(self.metrics, metrics_port, metrics_file)
+            except OSError as e:
+                print(f"Failed to start metrics exporter: {e}")
+        # Input latency of guesses; a pair accepts input MIN_PAIR_VIEW_MS after it was first shown
+        self.latency = LatencyTracker()
+        self.events_received_at = 0.0
+        self.last_poll_at = time.perf_counter()
+        self.pair_shown_ms = None
+        self.frame_ms = None  # game time of the frame being handled, as recorded
         self.music_mode = None  # 'idle' or 'game'
+        self.save_scores = True
+
+        # Seeding: the master seed derives one seed per session, so a whole run is reproducible
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.seed_rng = random.Random(self.seed)
+        self.rng = random.Random(self.seed)
+        self.session_seed = None
 
-        # current round
+        # current round; image buffers come from the pool and go back when the pair is replaced
+        self.surface_pool = SurfacePool()
         self.left_image = None
         self.right_image = None
         self.left_is_real = False
         self.left_label = ""
         self.right_label = ""
+        # Progressive display: thumbnails go up at once while loader threads decode the full pair
+        self.thumbnails = load_thumbnails(thumbnails_path(self.data_root))
+        self.loader = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-load")
+        self.pending_paths = None  # full-quality pair to decode once its thumbnails have been flipped
+        self.pending_pair = None  # loader futures for that pair
+        self.swap_full_pair = False  # swap it in this frame: set by run(), or by a replay from the recording
+        self.pair_requested_at = None
 
         self.clock = pygame.time.Clock()
         self.running = True
         self.countdown_sequence = [("3", 800), ("2", 800), ("1", 800), ("GO", 600)]  # in ms
+        self.text_cache = {}
+        self.needs_redraw = True
 
         # Leaderboard: default to NORMAL until a difficulty is chosen
         self.leaderboard_path = resource_path(LEADERBOARD_FILE_NORMAL)
@@ -292,6 +1646,14 @@ class FakeRealGame:
         except Exception:
             pass
 
+        self.change_state("intro")
+        self.recorder = SessionRecorder(record_path, self.seed, (self.screen_w, self.screen_h), self.intro_start_ms) if record_path else None
+
+    def now_ms(self) -> int:
+        # Within a frame game time stands still at the timestamp the recorder writes, so a
+        # replay (which sets its clock to that timestamp) makes exactly the same decisions
+        return self.frame_ms if self.frame_ms is not None else self.time_source()
+
     # -------------------------
     # Music control
     # -------------------------
@@ -314,118 +1676,163 @@ class FakeRealGame:
     # -------------------------
     def pick_random_paths(self):
         if self.random_category:
-            real_cat = random.choice(self.categories)
-            fake_cat = random.choice(self.categories)
-            real_path = random.choice(self.real_map[real_cat])
-            fake_path = random.choice(self.fake_map[fake_cat])
+            real_cat = self.rng.choice(self.categories)
+            fake_cat = self.rng.choice(self.categories)
+            real_path = self.rng.choice(self.real_map[real_cat])
+            fake_path = self.rng.choice(self.fake_map[fake_cat])
         else:
-            cat = random.choice(self.categories)
-            real_path = random.choice(self.real_map[cat])
-            fake_path = random.choice(self.fake_map[cat])
+            cat = self.rng.choice(self.categories)
+            real_path = self.rng.choice(self.real_map[cat])
+            fake_path = self.rng.choice(self.fake_map[cat])
+        if self.fake_neighbours:
+            fake_path = self.pick_similar_fake(real_path, fake_path)
         return real_path, fake_path
 
-    def load_image_scaled(self, path: str, rect: pygame.Rect):
+    def pick_similar_fake(self, real_path: str, fallback: str):
+        # Any category is fine in random-category mode, otherwise stay within the real image's category
+        any_category, same_category = self.fake_neighbours
+        candidates = (any_category if self.random_category else same_category).get(real_path)
+        return self.rng.choice(candidates) if candidates else fallback
+
+    def decode_image(self, path: str, size):
+        """Read one image and frame it at size like scale_to_fill_width_centered, with the
+        letterbox bands in the canvas colour. Runs on the loader threads, so it only uses
+        the display-independent batch scaling. Returns ((h, w, 4) RGBX array, seconds) or
+        None if the image can't be read.
+        """
+        t0 = time.perf_counter()
+        w, h = size
         try:
-            # Use Pillow to open, handle EXIF orientation, then convert to Pygame surface
-            img_pil = Image.open(path)
+            # JPEGs decode at a reduced scale that still covers the width, whichever way
+            # round the EXIF orientation turns the image
+            img_pil = open_image(self.archive.open(path) if self.archive else path, (w, w))
+            pixels = scale_batch_to_fill_width_centered([img_pil], w, h)[0]
+            pixels[pixels[..., 3] == 0] = (*CANVAS_BG, 255)
+            return pixels, time.perf_counter() - t0
+        except Exception as e:
+            print(f"Failed to load image {path}: {e}")
+            return None
 
+    def image_surface(self, decoded, rect: pygame.Rect):
+        """Copy a framed image into a pooled round buffer (a placeholder if decoding failed)."""
+        surf = self.surface_pool.acquire(rect.size)
+        if decoded is not None:
+            t0 = time.perf_counter()
+            pixels, decode_sec = decoded
             try:
-                for orientation in ExifTags.TAGS.keys():
-                    if ExifTags.TAGS[orientation] == 'Orientation':
-                        break
-                
-                exif = img_pil._getexif()
-
-                if exif is not None and orientation in exif:
-                    if exif[orientation] == 3:
-                        img_pil = img_pil.rotate(180, expand=True)
-                    elif exif[orientation] == 6:
-                        img_pil = img_pil.rotate(270, expand=True)
-                    elif exif[orientation] == 8:
-                        img_pil = img_pil.rotate(90, expand=True)
-            except (AttributeError, KeyError, IndexError):
-                # cases: image don't have getexif
-                pass
+                surf.blit(pygame.image.frombuffer(pixels, rect.size, 'RGBX'), (0, 0))
+                self.metrics.image_load.observe(decode_sec + time.perf_counter() - t0)
+                return surf
+            except Exception as e:
+                print(f"Failed to copy image: {e}")
+        self.metrics.image_load_failures.inc()
+        surf.fill(DARK_GRAY)
+        return surf
 
-            # Convert PIL image to Pygame surface
-            mode = img_pil.mode
-            size = img_pil.size
-            data = img_pil.tobytes()
-
-            if mode == 'RGB':
-                img = pygame.image.fromstring(data, size, mode)
-            elif mode == 'RGBA':
-                img = pygame.image.fromstring(data, size, mode)
-            else: # L, P, etc. Convert to RGB to be safe.
-                img_pil = img_pil.convert('RGB')
-                data = img_pil.tobytes()
-                img = pygame.image.fromstring(data, size, 'RGB')
-
-            if img.get_alpha() is not None:
-                img = img.convert_alpha()
-            else:
-                img = img.convert()
-            return scale_to_fill_width_centered(img, rect.width, rect.height)
-        except Exception as e:
-            print(f"Failed to load image {path}: {e}")
-            # Fallback placeholder
-            surf = pygame.Surface((rect.width, rect.height))
-            surf.fill(DARK_GRAY)
-            return surf
+    def load_image_scaled(self, path: str, rect: pygame.Rect):
+        return self.image_surface(self.decode_image(path, rect.size), rect)
+
+    def thumbnail_surface(self, pixels: np.ndarray, rect: pygame.Rect):
+        h, w, _ = pixels.shape
+        # Wraps the memory-mapped pixels directly; convert() makes the only copy, at thumbnail size
+        thumb = pygame.image.frombuffer(pixels, (w, h), 'RGB').convert()
+        return pygame.transform.smoothscale(thumb, rect.size, self.surface_pool.acquire(rect.size))
 
     def load_new_pair(self):
+        """Pick the next pair. When both images have thumbnails these are shown at once, the
+        loader threads decode the full images after the flip showing them and
+        finish_pending_pair() swaps them in; otherwise both images are loaded here.
+        """
+        previous = (self.left_image, self.right_image)
         real_path, fake_path = self.pick_random_paths()
         # Randomly assign sides
-        if random.random() < 0.5:
+        if self.rng.random() < 0.5:
             left_path, right_path = real_path, fake_path
             self.left_is_real = True
         else:
             left_path, right_path = fake_path, real_path
             self.left_is_real = False
-        self.left_image = self.load_image_scaled(left_path, self.left_rect)
-        self.right_image = self.load_image_scaled(right_path, self.right_rect)
+        # Time to first pixel is only meaningful for pairs loaded while the round is on screen
+        self.pair_requested_at = time.perf_counter() if self.current.shows_round else None
+        thumbs = [self.thumbnails.get(dataset_key(p)) for p in (left_path, right_path)] if self.thumbnails else []
+        if len(thumbs) == 2 and thumbs[0] is not None and thumbs[1] is not None:
+            self.left_image = self.thumbnail_surface(thumbs[0], self.left_rect)
+            self.right_image = self.thumbnail_surface(thumbs[1], self.right_rect)
+            self.pending_paths = (left_path, right_path)
+        else:
+            self.pending_paths = None
+            self.left_image = self.load_image_scaled(left_path, self.left_rect)
+            self.right_image = self.load_image_scaled(right_path, self.right_rect)
+            self.latency.loaded(time.perf_counter())
+        self.presenter.upload_round((self.left_image, self.right_image))
+        for surf in previous:
+            self.surface_pool.release(surf)
+        self.pending_pair = None
+        self.pair_shown_ms = None
+        if self.pending_paths and self.pair_requested_at is None:
+            self.start_full_pair()
         # Store labels for debugging (use filenames)
         self.left_label = os.path.basename(left_path)
         self.right_label = os.path.basename(right_path)
 
+    def start_full_pair(self):
+        rects = (self.left_rect, self.right_rect)
+        self.pending_pair = [self.loader.submit(self.decode_image, p, r.size) for p, r in zip(self.pending_paths, rects)]
+        self.pending_paths = None
+
+    def full_pair_ready(self) -> bool:
+        return self.pending_pair is not None and all(f.done() for f in self.pending_pair)
+
+    def finish_pending_pair(self):
+        """Swap the full-quality images in for the thumbnails (blocking until both are decoded)."""
+        left, right = (f.result() for f in self.pending_pair)
+        self.pending_pair = None
+        thumbs = (self.left_image, self.right_image)
+        self.left_image = self.image_surface(left, self.left_rect)
+        self.right_image = self.image_surface(right, self.right_rect)
+        self.presenter.upload_round((self.left_image, self.right_image))
+        for surf in thumbs:
+            self.surface_pool.release(surf)
+        self.latency.loaded(time.perf_counter())
+        self.needs_redraw = True
+
     # -------------------------
     # Drawing helpers
     # -------------------------
+    def cached_text(self, key: str, font, text: str, color) -> pygame.Surface:
+        """Render text for a slot that changes rarely (score, timer), re-rendering only on change."""
+        entry = self.text_cache.get(key)
+        if entry is None or entry[0] != (text, color):
+            entry = ((text, color), font.render(text, True, color))
+            self.text_cache[key] = entry
+        return entry[1]
+
     def draw_top_bar(self):
         # Background bar
-        pygame.draw.rect(self.canvas, BLACK, pygame.Rect(0, 0, CANVAS_WIDTH, TOP_BAR_H))
+        self.canvas.fill(BLACK, pygame.Rect(0, 0, CANVAS_WIDTH, TOP_BAR_H))
         # Score
-        score_text = f"Score: {self.score:.1f}"
-        score_surf = self.font.render(score_text, True, WHITE)
+        score_surf = self.cached_text("score", self.font, f"Score: {self.score:.1f}", WHITE)
         self.canvas.blit(score_surf, (20, (TOP_BAR_H - score_surf.get_height()) // 2))
         # Timer
         time_text = f"Time: {int(max(0, self.time_left))}s"
-        time_surf = self.font.render(time_text, True, YELLOW if self.time_left <= 10 else WHITE)
+        time_surf = self.cached_text("time", self.font, time_text, YELLOW if self.time_left <= 10 else WHITE)
         self.canvas.blit(time_surf, (CANVAS_WIDTH - time_surf.get_width() - 20, (TOP_BAR_H - time_surf.get_height()) // 2))
 
-    def draw_pass_button(self, hover: bool):
+    def make_pass_button(self, hover: bool) -> pygame.Surface:
         color = (230, 230, 230) if hover else (210, 210, 210)
         border = (90, 90, 90)
-        pygame.draw.rect(self.canvas, color, self.pass_rect, border_radius=16)
-        pygame.draw.rect(self.canvas, border, self.pass_rect, width=3, border_radius=16)
+        surf = pygame.Surface(self.pass_rect.size, pygame.SRCALPHA)
+        r = surf.get_rect()
+        pygame.draw.rect(surf, color, r, border_radius=16)
+        pygame.draw.rect(surf, border, r, width=3, border_radius=16)
         label = self.font_large.render("PASS", True, BLACK)
-        self.canvas.blit(label, (self.pass_rect.centerx - label.get_width() // 2, self.pass_rect.centery - label.get_height() // 2))
-
-    def draw_center_message(self, text: str, subtext: str | None = None, color=WHITE):
-        msg = self.font_large.render(text, True, color)
-        self.canvas.blit(msg, (CANVAS_WIDTH // 2 - msg.get_width() // 2, CANVAS_HEIGHT // 2 - msg.get_height() // 2))
-        if subtext:
-            sub = self.font.render(subtext, True, color)
-            self.canvas.blit(sub, (CANVAS_WIDTH // 2 - sub.get_width() // 2, CANVAS_HEIGHT // 2 + msg.get_height() // 2 + 20))
+        surf.blit(label, (r.centerx - label.get_width() // 2, r.centery - label.get_height() // 2))
+        return surf
 
-    def draw_text_center(self, text: str, y: int, color=WHITE, font=None):
-        f = font or self.font
-        surf = f.render(text, True, color)
-        self.canvas.blit(surf, (CANVAS_WIDTH // 2 - surf.get_width() // 2, y))
-
-    def draw_image_label(self, rect: pygame.Rect, text: str):
+    def make_image_label(self, rect: pygame.Rect, text: str):
+        """Return the (surface, position) blits of the filename label under an image."""
         if not text:
-            return
+            return []
         label = self.font_small.render(text, True, WHITE)
         pad_x, pad_y = 8, 4
         bg_w, bg_h = label.get_width() + pad_x * 2, label.get_height() + pad_y * 2
@@ -433,8 +1840,7 @@ class FakeRealGame:
         bg_y = rect.bottom - bg_h - 10
         bg = pygame.Surface((bg_w, bg_h), pygame.SRCALPHA)
         bg.fill((0, 0, 0, 160))
-        self.canvas.blit(bg, (bg_x, bg_y))
-        self.canvas.blit(label, (bg_x + pad_x, bg_y + pad_y))
+        return [(bg, (bg_x, bg_y)), (label, (bg_x + pad_x, bg_y + pad_y))]
 
     # -------------------------
     # Input mapping
@@ -457,40 +1863,24 @@ class FakeRealGame:
         cy = int((sy - target.y) * scale_y)
         return cx, cy
 
+    def mouse_canvas_pos(self):
+        return self.screen_to_canvas(*self.mouse_pos)
+
     # -------------------------
     # State transitions
     # -------------------------
-    def start_countdown(self):
-        self.state = "countdown"
-        self.countdown_index = 0
-        self.countdown_phase_start = pygame.time.get_ticks()
-        # Load first pair *after* difficulty is set
-        self.load_new_pair()
-        # Start background music (loop)
-        try:
-            self.set_music('game')
-        except Exception:
-            pass
-
-    def start_play(self):
-        self.state = "playing"
-        self.score = 0.0
-        self.round_index = 0
-        self.session_start_ms = pygame.time.get_ticks()
-        self.time_left = SESSION_TIME_SEC
-        # Ensure we have a pair ready
-        if self.left_image is None or self.right_image is None:
-            self.load_new_pair()
-
-    def end_play(self):
-        self.latest_score = self.score
-        self.state = "enter_name"
-        self.player_name = ""
-        # Switch back to idle music when session ends
-        try:
-            self.set_music('idle')
-        except Exception:
-            pass
+    def change_state(self, name: str):
+        if self.current is not None:
+            self.current.exit()
+        self.state = name
+        self.current = self.states[name]
+        self.current.enter()
+        self.needs_redraw = True
+
+    def choose_difficulty(self, hard: bool):
+        self.random_category = hard
+        self.leaderboard_path = resource_path(LEADERBOARD_FILE_HARD if hard else LEADERBOARD_FILE_NORMAL)
+        self.change_state("countdown")
 
     # -------------------------
     # Leaderboard logic
@@ -508,118 +1898,29 @@ class FakeRealGame:
         }
         entries.append(new_entry)
         entries = sorted(entries, key=lambda e: e.get("score", 0), reverse=True)[:10]
-        save_leaderboard(self.leaderboard_path, entries)
+        if self.save_scores:
+            save_leaderboard(self.leaderboard_path, entries)
         return entries
 
     # -------------------------
-    # Event handling per state
+    # Event handling
     # -------------------------
-    def handle_events(self):
-        for event in pygame.event.get():
+    def handle_events(self, events):
+        for event in events:
+            if event.type in (pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN):
+                self.mouse_pos = event.pos
             if event.type == pygame.QUIT:
                 self.running = False
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     self.running = False
-                # Skip intro on key
-                if self.state == "intro" and event.key in (pygame.K_RETURN, pygame.K_KP_ENTER, pygame.K_SPACE):
-                    self.state = "start_prompt"
-                    continue
-                # Close start prompt with Enter or Space -> go to difficulty selection
-                if self.state == "start_prompt":
-                    if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER, pygame.K_SPACE):
-                        self.state = "difficulty_prompt"
-                    continue
-
-                if self.state == "difficulty_prompt":
-                    # Keyboard shortcuts for difficulty selection
-                    if event.key in (pygame.K_n, pygame.K_LEFT):  # NORMALE
-                        self.random_category = False
-                        self.leaderboard_path = resource_path(LEADERBOARD_FILE_NORMAL)
-                        self.start_countdown()
-                    elif event.key in (pygame.K_d, pygame.K_RIGHT):  # DIFFICILE
-                        self.random_category = True
-                        self.leaderboard_path = resource_path(LEADERBOARD_FILE_HARD)
-                        self.start_countdown()
-                    continue
-
-                if self.state == "countdown":
-                    # optional: skip countdown? Not requested; keep it running.
-                    pass
-                elif self.state == "playing":
-                    now = pygame.time.get_ticks()
-                    if now - self.last_action_time < 500:
-                        continue
-                    # Keyboard controls: left/right choose, up/down pass
-                    if event.key == pygame.K_LEFT:
-                        self.handle_guess(is_left=True)
-                        self.last_action_time = now
-                    elif event.key == pygame.K_RIGHT:
-                        self.handle_guess(is_left=False)
-                        self.last_action_time = now
-                    elif event.key in (pygame.K_UP, pygame.K_DOWN):
-                        # Pass
-                        self.round_index += 1
-                        self.load_new_pair()
-                        self.last_action_time = now
-                    pass
-                elif self.state == "enter_name":
-                    if event.key == pygame.K_RETURN:
-                        # commit name and move to leaderboard
-                        self.leaderboard_entries = self.update_leaderboard()
-                        self.state = "leaderboard"
-                    elif event.key == pygame.K_BACKSPACE:
-                        self.player_name = self.player_name[:-1]
-                    else:
-                        if len(self.player_name) < 24:
-                            ch = event.unicode
-                            if ch.isprintable():
-                                self.player_name += ch
-                elif self.state == "leaderboard":
-                    if event.key in (pygame.K_RETURN, pygame.K_SPACE):
-                        # Restart flow: show rules then difficulty again
-                        self.state = "start_prompt"
-
+                self.current.on_key(event)
             elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                # Skip intro on click
-                if self.state == "intro":
-                    self.state = "start_prompt"
-                    continue
-                m = self.screen_to_canvas(*event.pos)
-                if m is None:
-                    continue
-                mx, my = m
-                # Click to close start prompt -> open difficulty prompt
-                if self.state == "start_prompt" and self.start_prompt_rect.collidepoint(mx, my):
-                    self.state = "difficulty_prompt"
-                    continue
-                # Click on difficulty buttons
-                if self.state == "difficulty_prompt":
-                    if self.diff_normal_rect.collidepoint(mx, my):
-                        self.random_category = False
-                        self.leaderboard_path = resource_path(LEADERBOARD_FILE_NORMAL)
-                        self.start_countdown()
-                        continue
-                    if self.diff_hard_rect.collidepoint(mx, my):
-                        self.random_category = True
-                        self.leaderboard_path = resource_path(LEADERBOARD_FILE_HARD)
-                        self.start_countdown()
-                        continue
-                if self.state == "playing":
-                    now = pygame.time.get_ticks()
-                    if now - self.last_action_time < 500:
-                        continue
-                    if self.pass_rect.collidepoint(mx, my):
-                        # Pass
-                        self.round_index += 1
-                        self.load_new_pair()
-                        self.last_action_time = now
-                    elif self.left_rect.collidepoint(mx, my):
-                        self.handle_guess(is_left=True)
-                        self.last_action_time = now
-                    elif self.right_rect.collidepoint(mx, my):
-                        self.handle_guess(is_left=False)
-                        self.last_action_time = now
+                self.current.on_click(event.pos)
+
+    def handle_pass(self):
+        self.round_index += 1
+        self.load_new_pair()
 
     def handle_guess(self, is_left: bool):
         correct = (is_left and self.left_is_real) or ((not is_left) and (not self.left_is_real))
@@ -641,271 +1942,114 @@ class FakeRealGame:
         self.load_new_pair()
 
     # -------------------------
-    # Update & Render per state
+    # Update & Render
     # -------------------------
     def update(self, dt_ms: int):
-        if self.state == "intro":
-            # Transition to start prompt after animation
-            total = self.INTRO_FADE_MS * 2 + self.INTRO_HOLD_MS
-            if pygame.time.get_ticks() - self.intro_start_ms >= total:
-                self.state = "start_prompt"
-                # Ensure idle music after intro
-                try:
-                    self.set_music('idle')
-                except Exception:
-                    pass
-                return
-        if self.state == "countdown":
-            now = pygame.time.get_ticks()
-            label, dur = self.countdown_sequence[self.countdown_index]
-            if now - self.countdown_phase_start >= dur:
-                self.countdown_index += 1
-                self.countdown_phase_start = now
-                if self.countdown_index >= len(self.countdown_sequence):
-                    self.start_play()
-        elif self.state == "playing":
-            elapsed = (pygame.time.get_ticks() - self.session_start_ms) / 1000.0
-            self.time_left = max(0.0, SESSION_TIME_SEC - elapsed)
-            if self.time_left <= 0:
-                self.end_play()
+        if self.pending_pair and self.swap_full_pair:
+            self.finish_pending_pair()
+        self.current.update(dt_ms)
 
     def render(self):
         # Clear canvas
-        self.canvas.fill((25, 25, 25))
-
-        # Intro animation (black background with fading logos)
-        if self.state == "intro":
-            self.canvas.fill(BLACK)
-            # Compute alpha
-            t = pygame.time.get_ticks() - self.intro_start_ms
-            fade = self.INTRO_FADE_MS
-            hold = self.INTRO_HOLD_MS
-            total = fade * 2 + hold
-            if t < fade:
-                alpha = int(255 * (t / fade))
-            elif t < fade + hold:
-                alpha = 255
-            elif t < total:
-                alpha = int(255 * (1 - (t - fade - hold) / fade))
-            else:
-                alpha = 0
-
-            if self.logo_main is not None:
-                # Determine sizes to fit
-                max_main_w = int(CANVAS_WIDTH * 0.7)
-                max_imp_w = int(CANVAS_WIDTH * 0.35)
-                gap = 24
-                # Start with requested widths
-                lm_w, lm_h = self.logo_main.get_size()
-                scale_main = min(1.0, max_main_w / max(1, lm_w))
-                main_w = int(lm_w * scale_main)
-                main_h = int(lm_h * scale_main)
-
-                if self.logo_imp is not None:
-                    li_w, li_h = self.logo_imp.get_size()
-                    scale_imp = 0.5
-                    imp_w = int(li_w * scale_imp)
-                    imp_h = int(li_h * scale_imp)
-                else:
-                    imp_w = imp_h = 0
-
-                # If total too tall, scale both down
-                total_h = main_h + (gap if imp_h else 0) + imp_h
-                avail_h = int(CANVAS_HEIGHT * 0.7)
-                if total_h > avail_h and total_h > 0:
-                    k = avail_h / total_h
-                    main_w = int(main_w * k)
-                    main_h = int(main_h * k)
-                    imp_w = int(imp_w * k)
-                    imp_h = int(imp_h * k)
-
-                layer = pygame.Surface((CANVAS_WIDTH, CANVAS_HEIGHT), pygame.SRCALPHA)
-                # Blit main logo centered
-                x_main = CANVAS_WIDTH // 2 - main_w // 2
-                y_main = CANVAS_HEIGHT // 2 - (main_h + (gap if imp_h else 0) + imp_h) // 2
-                main_scaled = pygame.transform.smoothscale(self.logo_main, (max(1, main_w), max(1, main_h)))
-                layer.blit(main_scaled, (x_main, y_main))
-                # Blit imp logo under
-                if self.logo_imp is not None and imp_w and imp_h:
-                    x_imp = CANVAS_WIDTH // 2 - imp_w // 2
-                    y_imp = y_main + main_h + gap
-                    imp_scaled = pygame.transform.smoothscale(self.logo_imp, (max(1, imp_w), max(1, imp_h)))
-                    layer.blit(imp_scaled, (x_imp, y_imp))
-                layer.set_alpha(max(0, min(255, alpha)))
-                self.canvas.blit(layer, (0, 0))
-            # Note: do not return here; let the common blit/flip run below
-
-        # Top bar
-        if self.state != "intro":
+        self.canvas.fill(CANVAS_BG)
+        if self.current.show_top_bar:
             self.draw_top_bar()
+        self.current.render(self.canvas)
+        self.present()
 
-        # Draw images only during playing (hide during countdown)
-        if self.state == "playing":
-            if self.left_image is not None:
-                self.canvas.blit(self.left_image, self.left_rect.topleft)
-            if self.right_image is not None:
-                self.canvas.blit(self.right_image, self.right_rect.topleft)
-
-        # Pass button (only when playing)
-        mouse_pos = pygame.mouse.get_pos()
-        cm = self.screen_to_canvas(*mouse_pos)
-        hover = False
-        if cm is not None:
-            hover = self.pass_rect.collidepoint(*cm)
-        if self.state == "playing":
-            self.draw_pass_button(hover)
-
-        # Debug labels under images
-        if self.state == "playing":
-            self.draw_image_label(self.left_rect, getattr(self, "left_label", ""))
-            self.draw_image_label(self.right_rect, getattr(self, "right_label", ""))
-
-        if self.state == "countdown":
-            # Overlay countdown
-            overlay = pygame.Surface((CANVAS_WIDTH, CANVAS_HEIGHT), pygame.SRCALPHA)
-            overlay.fill(SEMI_BLACK)
-            self.canvas.blit(overlay, (0, 0))
-            label, _ = self.countdown_sequence[self.countdown_index]
-            color = GREEN if label == "GO" else WHITE
-            surf = self.font_xlarge.render(label, True, color)
-            self.canvas.blit(surf, (CANVAS_WIDTH // 2 - surf.get_width() // 2, CANVAS_HEIGHT // 2 - surf.get_height() // 2))
-
-        # Start prompt rendering (fancier panel)
-        if self.state == "start_prompt":
-            # Dim background
-            overlay = pygame.Surface((CANVAS_WIDTH, CANVAS_HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 200))
-            self.canvas.blit(overlay, (0, 0))
-            # Shadow
-            shadow = self.start_prompt_rect.copy()
-            shadow.move_ip(8, 8)
-            pygame.draw.rect(self.canvas, (0, 0, 0, 120), shadow, border_radius=18)
-            # Panel
-            pygame.draw.rect(self.canvas, (245, 245, 245), self.start_prompt_rect, border_radius=18)
-            pygame.draw.rect(self.canvas, (30, 30, 30), self.start_prompt_rect, width=4, border_radius=18)
-            # Accent header
-            header = pygame.Rect(self.start_prompt_rect.x, self.start_prompt_rect.y, self.start_prompt_rect.width, 64)
-            pygame.draw.rect(self.canvas, (29, 41, 81), header, border_radius=18)
-            pygame.draw.line(self.canvas, (49, 61, 101), (self.start_prompt_rect.x + 12, header.bottom - 4), (self.start_prompt_rect.right - 12, header.bottom - 4), 3)
-            # Render rules lines (unchanged text)
-            y = self.start_prompt_rect.y + 84
-            for i, line in enumerate(self.start_rules):
-                font = self.font_large if i == 0 else self.font
-                color = BLACK if i == 0 else DARK_GRAY
-                surf = font.render(line, True, color)
-                x = self.start_prompt_rect.x + (self.start_prompt_rect.width - surf.get_width()) // 2
-                self.canvas.blit(surf, (x, y))
-                y += surf.get_height() + (16 if i == 0 else 12)
-
-        # Difficulty prompt rendering (fancier)
-        if self.state == "difficulty_prompt":
-            overlay = pygame.Surface((CANVAS_WIDTH, CANVAS_HEIGHT), pygame.SRCALPHA)
-            overlay.fill((0, 0, 0, 200))
-            self.canvas.blit(overlay, (0, 0))
-
-            # Shadow + Panel
-            shadow = self.diff_prompt_rect.copy()
-            shadow.move_ip(8, 8)
-            pygame.draw.rect(self.canvas, (0, 0, 0, 120), shadow, border_radius=18)
-            pygame.draw.rect(self.canvas, (245, 245, 245), self.diff_prompt_rect, border_radius=18)
-            pygame.draw.rect(self.canvas, (30, 30, 30), self.diff_prompt_rect, width=4, border_radius=18)
-
-            # Title and description (text unchanged)
-            title = self.font_large.render("Seleziona Modalità", True, BLACK)
-            tx = self.diff_prompt_rect.centerx - title.get_width() // 2
-            ty = self.diff_prompt_rect.y + 30
-            self.canvas.blit(title, (tx, ty))
-
-            desc_lines = [
-                "Modalità 1: le due foto appartengono alla stessa categoria (più difficile).",
-                "Modalità 2: le due foto appartengono a categorie diverse.",
-                "Clicca una modalità per iniziare.",
-            ]
-            y = ty + title.get_height() + 16
-            for line in desc_lines:
-                s = self.font.render(line, True, DARK_GRAY)
-                x = self.diff_prompt_rect.centerx - s.get_width() // 2
-                self.canvas.blit(s, (x, y))
-                y += s.get_height() + 6
-
-            # Buttons with hover
-            def draw_btn(rect: pygame.Rect, text: str):
-                mouse_pos = pygame.mouse.get_pos()
-                cm = self.screen_to_canvas(*mouse_pos)
-                hovered = bool(cm and rect.collidepoint(*cm))
-                btn_color = (235, 235, 235) if hovered else (220, 220, 220)
-                pygame.draw.rect(self.canvas, btn_color, rect, border_radius=16)
-                pygame.draw.rect(self.canvas, BLACK, rect, width=3, border_radius=16)
-                t = self.font_large.render(text, True, BLACK)
-                self.canvas.blit(t, (rect.centerx - t.get_width() // 2, rect.centery - t.get_height() // 2))
-
-            draw_btn(self.diff_normal_rect, "Modalità 1")
-            draw_btn(self.diff_hard_rect, "Modalità 2")
-
-        elif self.state == "enter_name":
-            # Result screen and name input (improved visuals)
-            self.draw_text_center("Il tempo è finito!", 150, color=YELLOW, font=self.font_large)
-            self.draw_text_center(f"Il tuo punteggio è: {self.latest_score:.1f}", 230, color=WHITE, font=self.font_large)
-            self.draw_text_center("Digita il tuo nome e premi INVIO:", 320, color=WHITE)
-            # Input panel with shadow
-            panel = pygame.Rect(0, 0, 800, 160)
-            panel.center = (CANVAS_WIDTH // 2, 500)
-            shadow = panel.copy(); shadow.move_ip(8, 8)
-            pygame.draw.rect(self.canvas, (0, 0, 0, 120), shadow, border_radius=14)
-            pygame.draw.rect(self.canvas, (245, 245, 245), panel, border_radius=14)
-            pygame.draw.rect(self.canvas, (30, 30, 30), panel, width=4, border_radius=14)
-            # Input box inside
-            box = pygame.Rect(panel.x + 40, panel.centery - 40, panel.width - 80, 80)
-            pygame.draw.rect(self.canvas, WHITE, box, border_radius=10)
-            pygame.draw.rect(self.canvas, BLACK, box, width=3, border_radius=10)
-            name_display = self.player_name if (pygame.time.get_ticks() // 500) % 2 == 0 else self.player_name + "|"
-            txt = self.font.render(name_display, True, BLACK)
-            self.canvas.blit(txt, (box.x + 16, box.y + (box.height - txt.get_height()) // 2))
-            # Hint
-            self.draw_text_center("(Usa Backspace per correggere)", panel.bottom + 20, color=GRAY)
-
-        elif self.state == "leaderboard":
-            difficolta = "Modalità 2" if self.random_category else "Modalità 1"
-            self.draw_text_center(f"Classifica ({difficolta})", 100, color=YELLOW, font=self.font_large)
-            entries = getattr(self, "leaderboard_entries", [])
-            # Fancy list: only position and name, with alternating row shades
-            y = 200
-            rank = 1
-            for e in entries:
-                name = e.get("name", "?")
-                score = e.get("score", "err")
-                row = pygame.Rect(CANVAS_WIDTH // 2 - 500, y - 8, 1000, 56)
-                shade = (245, 245, 245) if rank % 2 == 0 else (230, 230, 230)
-                pygame.draw.rect(self.canvas, shade, row, border_radius=10)
-                pygame.draw.rect(self.canvas, (200, 200, 200), row, width=2, border_radius=10)
-                line = f"{rank:2d}.  {name[:32]} : {score}"
-                s = self.font.render(line, True, BLACK)
-                self.canvas.blit(s, (row.x + 20, row.y + (row.height - s.get_height()) // 2))
-                y += 64
-                rank += 1
-            if self.just_qualified:
-                self.draw_text_center("Congratulazioni! Sei arrivato in Top 10!", y + 30, color=GREEN, font=self.font)
-            self.draw_text_center("Premi Invio per giocare ancora, oppure Esc per uscire.", CANVAS_HEIGHT - 80, color=GRAY, font=self.font)
-
-        # Blit canvas to screen (letterboxed)
-        target = self.canvas_target_rect_on_screen()
-        scaled = pygame.transform.smoothscale(self.canvas, (target.width, target.height))
-        self.screen.fill(BLACK)
-        self.screen.blit(scaled, target.topleft)
-        pygame.display.flip()
+    def present(self):
+        # Canvas to screen (letterboxed)
+        self.presenter.present(self.canvas, self.canvas_target_rect_on_screen())
+        if not self.current.shows_round:
+            return
+        now = time.perf_counter()
+        if self.pair_requested_at is not None:
+            self.latency.first_pixel(self.pair_requested_at, now)
+            self.metrics.first_pixel.observe(now - self.pair_requested_at)
+            self.pair_requested_at = None
+        # Decoding starts after the thumbnail flip, so on few cores it doesn't delay that frame
+        if self.pending_paths:
+            self.start_full_pair()
+        # The pair counts as shown (and starts accepting guesses) once the full-quality images are up
+        if self.pair_shown_ms is None and not self.pending_pair and not self.pending_paths:
+            self.pair_shown_ms = self.now_ms()  # the frame's timestamp, identical in a replay
+            self.latency.presented(now)
+
+    def pair_viewable(self) -> bool:
+        return self.pair_shown_ms is not None and self.now_ms() - self.pair_shown_ms >= MIN_PAIR_VIEW_MS
 
     # -------------------------
     # Main loop
     # -------------------------
+    def wait_for_frame(self):
+        """Pace the main loop. Animated screens tick at FPS; static screens block until input
+        arrives or the screen is due to change by itself. Returns (dt_ms, events, redraw).
+
+        Also sets events_received_at: polled events may have arrived any time since the
+        previous poll (including while clock.tick slept), so latency is measured from there.
+        """
+        if self.current.animated or self.needs_redraw:
+            dt = self.clock.tick(FPS)
+            events = pygame.event.get()
+            self.events_received_at = self.last_poll_at
+            self.last_poll_at = time.perf_counter()
+            return dt, events, True
+        now = self.time_source()
+        due = self.current.next_redraw_ms(now)
+        timeout = IDLE_WAIT_MAX_MS if due is None else min(IDLE_WAIT_MAX_MS, due - now)
+        events = []
+        if timeout > 0:
+            first = pygame.event.wait(timeout)
+            if first.type != pygame.NOEVENT:
+                events.append(first)
+        # event.wait returns as soon as the first event arrives
+        self.events_received_at = time.perf_counter() if events else self.last_poll_at
+        events += pygame.event.get()
+        self.last_poll_at = time.perf_counter()
+        dt = self.clock.tick()
+        redraw = bool(events) or (due is not None and self.time_source() >= due)
+        return dt, events, redraw
+
     def run(self):
         while self.running:
-            dt = self.clock.tick(FPS)
-            self.handle_events()
+            dt, events, redraw = self.wait_for_frame()
+            self.frame_ms = self.time_source()
+            # Decided once per frame and recorded, so a replay swaps on the same frame
+            self.swap_full_pair = self.full_pair_ready()
+            if self.current.animated:
+                self.metrics.frame_time.observe(dt / 1000.0)
+            if self.recorder:
+                self.recorder.frame(self.frame_ms, events, self.swap_full_pair)
+            self.handle_events(events)
             self.update(dt)
-            self.render()
+            if redraw or self.needs_redraw:
+                self.render()
+                self.needs_redraw = False
+        if self.recorder:
+            self.recorder.close()
+        self.loader.shutdown(cancel_futures=True)
+        if self.archive:
+            self.archive.close()
+        if self.metrics_exporter:
+            self.metrics_exporter.close()
         pygame.quit()
 
 
 if __name__ == "__main__":
-    game = FakeRealGame()
-    game.run()
+    parser = argparse.ArgumentParser(description="Fake vs Real image guessing game")
+    parser.add_argument("--seed", type=int, help="master RNG seed, makes the sequence of pairs reproducible")
+    parser.add_argument("--record", metavar="PATH", help="record input events to PATH for later replay")
+    parser.add_argument("--replay", metavar="PATH", help="replay a recording headlessly and report frame times")
+    parser.add_argument("--replay-stats", metavar="CSV", help="with --replay, write per-frame timings to CSV")
+    parser.add_argument("--backend", choices=RENDER_BACKENDS, default=RENDER_BACKEND, help="presentation backend")
+    parser.add_argument("--data", metavar="PATH", help="dataset folder or zip archive (default: ./data, else ./data.zip)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="serve Prometheus metrics on 127.0.0.1:PORT")
+    parser.add_argument("--metrics-file", metavar="PATH", default=METRICS_FILE, help="periodically write a metrics snapshot to PATH")
+    args = parser.parse_args()
+
+    if args.replay:
+        replay_session(args.replay, args.replay_stats, backend=args.backend, data_path=args.data)
+    else:
+        game = FakeRealGame(seed=args.seed, record_path=args.record, backend=args.backend, data_path=args.data,
+                            metrics_port=args.metrics_port, metrics_file=args.metrics_file)
+        game.run()